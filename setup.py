@@ -29,6 +29,13 @@ INSTALL_REQUIRES = [
         "psutil>=5.6.7",
         ]
 
+ENTRY_POINTS = {
+        "console_scripts": [
+            "pyencfs = pyencfs.cli:main",
+            "pyencfs-daemon = pyencfs.daemon:main",
+            ],
+        }
+
 ###################################################################
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -78,5 +85,6 @@ if __name__ == "__main__":
         zip_safe=False,
         classifiers=CLASSIFIERS,
         install_requires=INSTALL_REQUIRES,
+        entry_points=ENTRY_POINTS,
         options={"bdist_wheel": {"universal": "1"}},
     )
@@ -0,0 +1,91 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .scan import _default_workers
+
+
+log = logging.getLogger(__name__)
+
+PROC = "/proc"
+
+
+def _within(target, path):
+    return target == path or target.startswith(path + "/")
+
+
+def _readlink(link):
+    try:
+        return os.readlink(link)
+    except OSError:
+        return ""
+
+
+def _process_uses(pid, path):
+    """Reasons why the process with the given pid keeps path busy"""
+    base = os.path.join(PROC, pid)
+    reasons = set()
+    for link in ("cwd", "root", "exe"):
+        if _within(_readlink(os.path.join(base, link)), path):
+            reasons.add(link)
+    try:
+        fds = os.listdir(os.path.join(base, "fd"))
+    except OSError:
+        fds = []
+    for fd in fds:
+        if _within(_readlink(os.path.join(base, "fd", fd)), path):
+            reasons.add("fd")
+            break
+    try:
+        with open(os.path.join(base, "maps")) as f:
+            for line in f:
+                fields = line.split(None, 5)
+                if len(fields) == 6 and _within(fields[5].rstrip("\n"),
+                                                path):
+                    reasons.add("maps")
+                    break
+    except OSError:
+        pass
+    return reasons
+
+
+def _name(pid):
+    try:
+        with open(os.path.join(PROC, pid, "comm")) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def find_blockers(path, workers=None):
+    """Find processes keeping a mount point busy
+
+    Scans the current directory, root, executable, open file descriptors
+    and memory maps of all processes in /proc with a pool of workers.
+    Processes of other users are only found with sufficient privileges.
+
+    Parameters:
+    ===========
+    path : str
+        mount point to check
+    workers : int
+        number of processes checked in parallel
+
+    Returns:
+    ========
+    list of dicts with "pid", "name" and "reasons" (list of "cwd", "root",
+    "exe", "fd" and "maps") sorted by pid
+    """
+    path = os.path.realpath(str(path))
+    pids = [p for p in os.listdir(PROC) if p.isdigit()]
+    workers = workers or _default_workers()
+    blockers = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for pid, reasons in zip(pids, pool.map(
+                lambda p: _process_uses(p, path), pids)):
+            if reasons:
+                blockers.append({"pid": int(pid),
+                                 "name": _name(pid),
+                                 "reasons": sorted(reasons)})
+    log.debug("Found %d processes using %s", len(blockers), path)
+    return sorted(blockers, key=lambda b: b["pid"])
@@ -0,0 +1,260 @@
+import argparse
+import getpass
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .pyencfs import PyEncfs
+
+
+OPERATIONS = ["create", "mount", "umount", "check_password",
+              "change_password", "is_encfs"]
+
+
+def _password(env, prompt):
+    """Password from the given environment variable or a prompt"""
+    if env in os.environ:
+        return os.environ[env]
+    return getpass.getpass(prompt)
+
+
+def _resolve(args):
+    """Replace "<name>_env" arguments by the environment variable value"""
+    resolved = {}
+    for key, value in args.items():
+        if key.endswith("_env"):
+            if value not in os.environ:
+                raise KeyError("Environment variable %s not set" % value)
+            resolved[key[:-len("_env")]] = os.environ[value]
+        else:
+            resolved[key] = value
+    return resolved
+
+
+class PlanError(Exception):
+    """Invalid plan file"""
+
+
+def _validate(plan):
+    """Raise PlanError unless plan is a well formed, acyclic plan"""
+    if not isinstance(plan, dict) or not isinstance(plan.get("steps"), list):
+        raise PlanError("Plan has no list of steps")
+    steps = plan["steps"]
+    ids = set()
+    for step in steps:
+        if not isinstance(step, dict):
+            raise PlanError("Step %r is no object" % (step,))
+        if not isinstance(step.get("id"), str) or step["id"] in ids:
+            raise PlanError("Missing, invalid or duplicate step id %r"
+                            % (step.get("id"),))
+        if step.get("op") not in OPERATIONS:
+            raise PlanError("Unknown operation %s in step %s"
+                            % (step.get("op"), step["id"]))
+        if not isinstance(step.get("args", {}), dict):
+            raise PlanError("Arguments of step %s are no object"
+                            % step["id"])
+        if not isinstance(step.get("after", []), list):
+            raise PlanError("Dependencies of step %s are no list"
+                            % step["id"])
+        ids.add(step["id"])
+    for step in steps:
+        for dep in step.get("after", []):
+            if not isinstance(dep, str) or dep not in ids:
+                raise PlanError("Step %s depends on unknown step %r"
+                                % (step["id"], dep))
+    # reject cycles: repeatedly remove steps without open dependencies
+    open_steps = {s["id"]: set(s.get("after", [])) for s in steps}
+    while open_steps:
+        ready = [i for i, deps in open_steps.items() if not deps]
+        if not ready:
+            raise PlanError("Dependency cycle between steps %s"
+                            % sorted(open_steps))
+        for i in ready:
+            del open_steps[i]
+        for deps in open_steps.values():
+            deps.difference_update(ready)
+
+
+def load_plan(path):
+    """Read and validate a plan file
+
+    A plan is a JSON object with a list of "steps". Each step has a unique
+    "id", an "op" (one of OPERATIONS), the keyword "args" of the PyEncfs
+    method and optionally a list "after" of step ids it depends on.
+    Arguments ending in "_env" name an environment variable holding the
+    value, e.g. "password_env": "VOLUME_PASSWORD".
+
+    Parameters:
+    ===========
+    path : str
+        path to the plan file
+
+    Returns:
+    ========
+    dict with the plan
+    """
+    with open(str(path)) as f:
+        plan = json.load(f)
+    _validate(plan)
+    return plan
+
+
+def apply_plan(plan, pyencfs, workers=4):
+    """Execute the steps of a plan concurrently
+
+    A step starts as soon as all steps it depends on succeeded. Steps
+    depending on a failed step are skipped.
+
+    Parameters:
+    ===========
+    plan : dict
+        plan as returned by load_plan
+    pyencfs : PyEncfs
+        instance executing the operations
+    workers : int
+        maximum number of steps running at the same time
+
+    Returns:
+    ========
+    list of step reports (dicts with "id", "op", "status" being "ok",
+    "failed" or "skipped", "seconds" and "error") in plan order
+
+    Raises PlanError for invalid plans, e.g. with dependency cycles.
+    """
+    _validate(plan)
+    steps = {s["id"]: s for s in plan["steps"]}
+    reports = {}
+
+    def _run(step):
+        start = time.monotonic()
+        error = None
+        try:
+            ok = getattr(pyencfs, step["op"])(
+                    **_resolve(step.get("args", {})))
+        except Exception as err:
+            ok = False
+            error = str(err)
+        return {"id": step["id"], "op": step["op"],
+                "status": "ok" if ok else "failed",
+                "seconds": round(time.monotonic() - start, 6),
+                "error": error}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while len(reports) < len(steps):
+            for i, step in steps.items():
+                if i in reports or i in running.values():
+                    continue
+                deps = [reports.get(d) for d in step.get("after", [])]
+                if any(d is not None and d["status"] != "ok" for d in deps):
+                    reports[i] = {"id": i, "op": step["op"],
+                                  "status": "skipped", "seconds": 0,
+                                  "error": "dependency failed"}
+                elif all(d is not None for d in deps):
+                    running[pool.submit(_run, step)] = i
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                reports[running.pop(future)] = future.result()
+    return [reports[s["id"]] for s in plan["steps"]]
+
+
+def _positive_int(value):
+    """argparse type of integers greater than zero"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("%r is no positive integer" % value)
+    return number
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+            prog="pyencfs",
+            description="Manage encfs volumes, results are printed as JSON")
+    parser.add_argument("--options", default="--standard",
+                        help="encfs options for new volumes, pass options "
+                        "starting with - as --options=--paranoia "
+                        "(default %(default)s)")
+    parser.add_argument("--password-env", default="PYENCFS_PASSWORD",
+                        help="environment variable holding the password, "
+                        "prompted for if not set (default %(default)s)")
+    parser.add_argument("--new-password-env", default="PYENCFS_NEW_PASSWORD",
+                        help="environment variable holding the new password "
+                        "for change-password (default %(default)s)")
+    parser.add_argument("--verbose", action="store_true")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("create", help="create and mount a new volume")
+    p.add_argument("path_encrypted")
+    p.add_argument("path_decrypted")
+    p = sub.add_parser("mount", help="mount a volume")
+    p.add_argument("path_encrypted")
+    p.add_argument("path_decrypted")
+    p = sub.add_parser("umount", help="unmount a volume")
+    p.add_argument("path")
+    p = sub.add_parser("check-password", help="check the volume password")
+    p.add_argument("path_encrypted")
+    p = sub.add_parser("change-password", help="change the volume password")
+    p.add_argument("path_encrypted")
+    p = sub.add_parser("is-encfs", help="check for an encfs directory")
+    p.add_argument("path_encrypted")
+    p = sub.add_parser("apply", help="execute a plan file")
+    p.add_argument("plan")
+    p.add_argument("--workers", type=_positive_int, default=4,
+                   help="steps run concurrently (default %(default)s)")
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the pyencfs command
+
+    Returns:
+    ========
+    exit code, 0 on success and 1 on failure
+    """
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.WARNING, stream=sys.stderr)
+    e = PyEncfs(args.options)
+    output = {"command": args.command}
+    if args.command == "apply":
+        try:
+            plan = load_plan(args.plan)
+        except (OSError, ValueError, PlanError) as err:
+            output.update(ok=False, error=str(err))
+        else:
+            start = time.monotonic()
+            steps = apply_plan(plan, e, args.workers)
+            output.update(ok=all(s["status"] == "ok" for s in steps),
+                          seconds=round(time.monotonic() - start, 6),
+                          steps=steps)
+    else:
+        if args.command in ("create", "mount"):
+            ok = getattr(e, args.command)(
+                    args.path_encrypted, args.path_decrypted,
+                    _password(args.password_env, "Password: "))
+        elif args.command == "umount":
+            ok = e.umount(args.path)
+        elif args.command == "check-password":
+            ok = e.check_password(args.path_encrypted,
+                                  _password(args.password_env, "Password: "))
+        elif args.command == "change-password":
+            ok = e.change_password(
+                    args.path_encrypted,
+                    _password(args.password_env, "Current password: "),
+                    _password(args.new_password_env, "New password: "))
+        else:
+            ok = e.is_encfs(args.path_encrypted)
+        output["ok"] = bool(ok)
+    print(json.dumps(output))
+    return 0 if output["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+
+log = logging.getLogger(__name__)
+
+CONFIG_FILE = ".encfs6.xml"
+
+# xml tag -> (key, type) of the configuration values made available,
+# key material (encodedKeyData, saltData) is never read
+_FIELDS = {
+    "version": ("version", int),
+    "creator": ("creator", str),
+    "keySize": ("key_size", int),
+    "blockSize": ("block_size", int),
+    "plainData": ("plain_data", bool),
+    "uniqueIV": ("unique_iv", bool),
+    "chainedNameIV": ("chained_name_iv", bool),
+    "externalIVChaining": ("external_iv_chaining", bool),
+    "blockMACBytes": ("block_mac_bytes", int),
+    "blockMACRandBytes": ("block_mac_rand_bytes", int),
+    "allowHoles": ("allow_holes", bool),
+    "kdfIterations": ("kdf_iterations", int),
+}
+
+
+def read_config(path_encrypted):
+    """Parse the .encfs6.xml configuration of an encfs directory
+
+    Reads the configuration file directly without calling encfsctl.
+
+    Parameters:
+    ===========
+    path_encrypted : str
+        path to the encrypted directory holding the encfs file system
+
+    Returns:
+    ========
+    dict with configuration values or None if the configuration could not
+    be read
+    """
+    path = os.path.join(str(path_encrypted), CONFIG_FILE)
+    try:
+        cfg = ET.parse(path).getroot().find("cfg")
+    except (OSError, ET.ParseError):
+        log.debug("Unable to load or parse config file %s", path)
+        return None
+    if cfg is None:
+        log.debug("No encfs configuration found in %s", path)
+        return None
+    config = {}
+    for tag, (key, conv) in _FIELDS.items():
+        node = cfg.find(tag)
+        if node is not None and node.text is not None:
+            value = node.text.strip()
+            config[key] = bool(int(value)) if conv is bool else conv(value)
+    for tag, key in (("cipherAlg", "cipher"), ("nameAlg", "name_encoding")):
+        node = cfg.find(tag)
+        if node is not None and node.find("name") is not None:
+            config[key] = node.find("name").text
+    if "block_size" not in config:
+        log.debug("Incomplete encfs configuration in %s", path)
+        return None
+    return config
+
+
+def header_size(config):
+    """Size of the per file header (unique IV) in the encrypted file"""
+    return 8 if config.get("unique_iv") else 0
+
+
+def block_overhead(config):
+    """Bytes of MAC data stored within each encrypted block"""
+    return config.get("block_mac_bytes", 0) + \
+        config.get("block_mac_rand_bytes", 0)
+
+
+def plain_size(config, size):
+    """Plain file size of an encrypted file of the given size
+
+    encfs stores an optional header with the file IV, followed by blocks of
+    block_size bytes each starting with the block MAC. The last block is
+    not padded.
+
+    Parameters:
+    ===========
+    config : dict
+        configuration as returned by read_config
+    size : int
+        size of the encrypted file in bytes
+
+    Returns:
+    ========
+    size of the plain file in bytes
+    """
+    size -= header_size(config)
+    if size <= 0:
+        return 0
+    overhead = block_overhead(config)
+    blocks, rest = divmod(size, config["block_size"])
+    return blocks * (config["block_size"] - overhead) + \
+        max(rest - overhead, 0)
@@ -0,0 +1,231 @@
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .scan import scantree, _default_workers
+
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1 << 20
+RENAME_EXCHANGE = 2
+FICLONE = 0x40049409
+
+
+def copy_file(src, dst):
+    """Copy file content and metadata with bounded memory
+
+    Parameters:
+    ===========
+    src : str
+        source file
+    dst : str
+        destination file, overwritten if it exists
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+    shutil.copystat(src, dst)
+
+
+def clone_file(src, dst):
+    """Copy a file using reflinks or in-kernel copies where available
+
+    Tries a FICLONE reflink first (btrfs, xfs, ...), which shares the data
+    blocks and is independent of the file size. Falls back to
+    copy_file_range, which copies within the kernel, and finally to a
+    regular chunked copy.
+
+    Parameters:
+    ===========
+    src : str
+        source file
+    dst : str
+        destination file, overwritten if it exists
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                           size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except (OSError, AttributeError):
+                fsrc.seek(copied)
+                fdst.seek(copied)
+                shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+    shutil.copystat(src, dst)
+
+
+def file_hash(path):
+    """sha256 hex digest of the file content at the given path"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _raise(path, err):
+    """scantree error handler aborting the walk"""
+    raise err
+
+
+def _copy_entry(entry, dst, copy):
+    if entry.is_symlink():
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.symlink(os.readlink(entry.path), dst)
+    else:
+        copy(entry.path, dst)
+
+
+def copy_tree(src, dst, workers=None, done=None, on_done=None,
+              copy=copy_file):
+    """Copy a directory tree with a pool of parallel file copies
+
+    Parameters:
+    ===========
+    src : str
+        source directory
+    dst : str
+        destination directory, created if missing
+    workers : int
+        number of files copied in parallel
+    done : set
+        relative paths of files already copied, these are skipped
+    on_done : callable
+        called with the relative path of every copied file
+    copy : callable
+        function copying a single file from src to dst path
+
+    Returns:
+    ========
+    number of files copied
+
+    Raises OSError if a directory of src cannot be read.
+    """
+    src = str(src)
+    dst = str(dst)
+    workers = workers or _default_workers()
+    done = done or set()
+    count = 0
+
+    def _copy(entry, rel):
+        _copy_entry(entry, os.path.join(dst, rel), copy)
+        if on_done is not None:
+            on_done(rel)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        for root, dirs, files in scantree(src, workers, _raise):
+            rel_root = os.path.relpath(root, src)
+            dst_root = os.path.normpath(os.path.join(dst, rel_root))
+            os.makedirs(dst_root, exist_ok=True)
+            shutil.copymode(root, dst_root)
+            for entry in files:
+                rel = os.path.normpath(os.path.join(rel_root, entry.name))
+                if rel in done:
+                    continue
+                if len(running) >= workers * 2:
+                    finished, running = wait(running,
+                                             return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                running.add(pool.submit(_copy, entry, rel))
+                count += 1
+        for future in running:
+            future.result()
+    return count
+
+
+def compare_trees(src, dst, workers=None):
+    """Compare content of all files of two directory trees
+
+    Parameters:
+    ===========
+    src : str
+        first directory
+    dst : str
+        second directory
+    workers : int
+        number of files compared in parallel
+
+    Returns:
+    ========
+    list of relative paths which differ or are missing in one of the trees
+    """
+    src = str(src)
+    dst = str(dst)
+    workers = workers or _default_workers()
+
+    def _listing(top):
+        paths = set()
+        for root, dirs, files in scantree(top, workers, _raise):
+            for entry in files:
+                paths.add(os.path.relpath(entry.path, top))
+        return paths
+
+    src_paths = _listing(src)
+    dst_paths = _listing(dst)
+    differ = sorted(src_paths ^ dst_paths)
+
+    def _differs(rel):
+        a = os.path.join(src, rel)
+        b = os.path.join(dst, rel)
+        if os.path.islink(a) or os.path.islink(b):
+            return os.readlink(a) != os.readlink(b)
+        return file_hash(a) != file_hash(b)
+
+    common = sorted(src_paths & dst_paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rel, result in zip(common, pool.map(_differs, common)):
+            if result:
+                differ.append(rel)
+    return sorted(differ)
+
+
+def exchange_paths(a, b):
+    """Atomically exchange two directories
+
+    Uses renameat2(RENAME_EXCHANGE) on Linux. If the system call is not
+    available, the directories are swapped with three renames, which is
+    not atomic.
+
+    Parameters:
+    ===========
+    a : str
+        first path
+    b : str
+        second path
+    """
+    a = os.fsencode(str(a))
+    b = os.fsencode(str(b))
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError, TypeError):
+        renameat2 = None
+    if renameat2 is not None:
+        at_fdcwd = -100
+        if renameat2(at_fdcwd, a, at_fdcwd, b, RENAME_EXCHANGE) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in (errno.ENOSYS, errno.EINVAL):
+            raise OSError(err, os.strerror(err), a, None, b)
+    log.warning("Atomic exchange not supported, swapping with renames")
+    tmp = a + b".swap"
+    os.rename(a, tmp)
+    os.rename(b, a)
+    os.rename(tmp, b)
@@ -0,0 +1,346 @@
+import argparse
+import errno
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+
+from .config import read_config, CONFIG_FILE
+from .pyencfs import PyEncfs
+from .registry import VolumeRegistry
+
+
+def _default_socket():
+    """Socket path in a directory only the current user can write to"""
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "pyencfs.sock")
+    return os.path.join(tempfile.gettempdir(), "pyencfs-%d" % os.getuid(),
+                        "pyencfs.sock")
+
+
+DEFAULT_SOCKET = _default_socket()
+
+
+def _checksocketdir(path):
+    """Create the socket directory and make sure only we can write to it
+
+    Raises OSError if the directory is a symbolic link, is owned by
+    another user or is writable by group or others, as another user could
+    then put its own socket in place.
+    """
+    os.makedirs(path, 0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+            st.st_mode & 0o022:
+        raise PermissionError("Unsafe socket directory %s" % path)
+
+
+def _checksocket(path):
+    """Raise OSError unless path is a socket of the current user or root
+
+    Keeps clients from sending passwords to a socket of another user.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid not in (os.getuid(), 0):
+        raise PermissionError("Socket %s is not owned by the current user"
+                              % path)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serve requests of one client connection
+
+    Each request and response is a single line of JSON. Leases acquired
+    through a connection are released when the connection closes, and a
+    connection can only release leases it acquired itself.
+    """
+
+    def handle(self):
+        leases = []
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    op = request["op"]
+                    args = request.get("args", {})
+                    if not isinstance(args, dict):
+                        raise ValueError("Arguments must be an object")
+                    if op in ("lease", "release"):
+                        if not isinstance(args.get("path"), str):
+                            raise ValueError("Missing path of %s" % op)
+                        path = os.path.abspath(args["path"])
+                        if op == "release" and path not in leases:
+                            raise ValueError("No lease on %s held by this "
+                                             "connection" % path)
+                    result = self.server.daemon.call(op, args)
+                    if op == "lease" and result:
+                        leases.append(path)
+                    elif op == "release":
+                        leases.remove(path)
+                    response = {"ok": True, "result": result}
+                except Exception as err:
+                    self.server.daemon.log.exception("Failed request")
+                    response = {"ok": False, "error": str(err)}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                self.wfile.flush()
+        finally:
+            for path in leases:
+                self.server.daemon.pyencfs.release_lease(path)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PyEncfsDaemon():
+    """Long running service holding PyEncfs state
+
+    Keeps a single PyEncfs instance, mounted volumes and parsed volume
+    configurations for its whole lifetime and serves mount, umount, drain,
+    status, check_password and lease requests of PyEncfsClient over a
+    Unix domain socket. Volumes already mounted are not mounted again, and
+    volumes with leases are only unmounted by drain.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, options="--standard",
+                 registry=None):
+        """Set up the daemon
+
+        Parameters:
+        ===========
+        socket_path : str
+            path of the Unix domain socket to listen on
+        options : str
+            encfs options used to create new volumes
+        registry : VolumeRegistry
+            registry to record volume changes in
+        """
+        self.name = "PyEncfsDaemon"
+        self.log = logging.getLogger(__name__ + "." + self.name)
+        self.socket_path = str(socket_path)
+        self.pyencfs = PyEncfs(options, registry)
+        self.configs = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.ops = {
+            "ping": lambda: True,
+            "mount": self.mount,
+            "umount": self.umount,
+            "drain": self.pyencfs.drain_and_umount,
+            "status": self.status,
+            "check_password": self.pyencfs.check_password,
+            "lease": self.pyencfs.acquire_lease,
+            "release": self.pyencfs.release_lease,
+        }
+
+    def call(self, op, args):
+        """Execute a single request"""
+        if op not in self.ops:
+            raise ValueError("Unknown operation %s" % op)
+        return self.ops[op](**args)
+
+    def config(self, path_encrypted):
+        """Parsed configuration of a volume, cached until the file changes"""
+        path = os.path.join(str(path_encrypted), CONFIG_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.configs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        config = read_config(path_encrypted)
+        with self.lock:
+            self.configs[path] = (mtime, config)
+        return config
+
+    def mount(self, path_encrypted, path_decrypted, password):
+        """Mount a volume unless it is mounted already"""
+        if os.path.ismount(str(path_decrypted)) and \
+                self.pyencfs._isencfsmount(path_decrypted):
+            self.log.debug("Volume is mounted already at %s",
+                           path_decrypted)
+            return True
+        return self.pyencfs.mount(path_encrypted, path_decrypted, password)
+
+    def umount(self, path):
+        """Unmount a volume unless clients hold leases on it"""
+        path = os.path.abspath(str(path))
+        pyencfs = self.pyencfs
+        with pyencfs._lease_lock:
+            leases = pyencfs._leases.get(path, 0)
+            if leases or path in pyencfs._draining:
+                self.log.error("Refusing to unmount %s with %d leases, "
+                               "use drain instead!", path, leases)
+                return False
+            # no new leases until the volume is unmounted
+            pyencfs._draining.add(path)
+        try:
+            return pyencfs.umount(path)
+        finally:
+            with pyencfs._lease_lock:
+                pyencfs._draining.discard(path)
+
+    def status(self, path_decrypted, path_encrypted=None):
+        """Mount status, leases and configuration of a volume"""
+        path = os.path.abspath(str(path_decrypted))
+        result = {"mounted": os.path.ismount(path),
+                  "leases": self.pyencfs._leases.get(path, 0)}
+        if path_encrypted is not None:
+            result["config"] = self.config(path_encrypted)
+        return result
+
+    def _remove_stale_socket(self):
+        """Remove the socket of a daemon which is not running anymore
+
+        Raises OSError if another daemon answers on the socket or the path
+        is no socket at all.
+        """
+        try:
+            mode = os.lstat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(errno.EEXIST, "Not a socket", self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except ConnectionRefusedError:
+            self.log.info("Removing stale socket %s", self.socket_path)
+            os.remove(self.socket_path)
+            return
+        finally:
+            sock.close()
+        raise OSError(errno.EADDRINUSE, "Another pyencfs daemon is "
+                      "listening", self.socket_path)
+
+    def serve_forever(self):
+        """Listen on the socket and serve requests until shutdown()
+
+        A socket left behind by a daemon which is not running anymore is
+        replaced, OSError is raised if another daemon is listening or the
+        socket directory is writable by other users.
+        """
+        _checksocketdir(os.path.dirname(os.path.abspath(self.socket_path)))
+        self._remove_stale_socket()
+        umask = os.umask(0o177)
+        try:
+            self.server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon = self
+        self.log.info("Listening on %s", self.socket_path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+
+    def shutdown(self):
+        """Stop serve_forever from another thread"""
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def _abspath(path):
+    return os.path.abspath(str(path))
+
+
+class PyEncfsClient():
+    """Client of PyEncfsDaemon
+
+    Keeps one connection to the daemon, each call is a single round trip
+    over the Unix domain socket. Paths are made absolute before they are
+    sent, as the daemon runs in a different working directory.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        _checksocket(str(socket_path))
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(socket_path))
+        self.rfile = self.sock.makefile("rb")
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _call(self, op, **args):
+        self.sock.sendall(json.dumps({"op": op, "args": args}).encode() +
+                          b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Connection closed by pyencfs daemon")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def ping(self):
+        return self._call("ping")
+
+    def mount(self, path_encrypted, path_decrypted, password):
+        return self._call("mount", path_encrypted=_abspath(path_encrypted),
+                          path_decrypted=_abspath(path_decrypted),
+                          password=password)
+
+    def umount(self, path):
+        return self._call("umount", path=_abspath(path))
+
+    def drain(self, path, timeout=30):
+        return self._call("drain", path=_abspath(path), timeout=timeout)
+
+    def status(self, path_decrypted, path_encrypted=None):
+        if path_encrypted is not None:
+            path_encrypted = _abspath(path_encrypted)
+        return self._call("status", path_decrypted=_abspath(path_decrypted),
+                          path_encrypted=path_encrypted)
+
+    def check_password(self, path_encrypted, password):
+        return self._call("check_password",
+                          path_encrypted=_abspath(path_encrypted),
+                          password=password)
+
+    def lease(self, path):
+        return self._call("lease", path=_abspath(path))
+
+    def release(self, path):
+        return self._call("release", path=_abspath(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Serve PyEncfs requests on a Unix domain socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help="path of the socket (default %(default)s)")
+    parser.add_argument("--options", default="--standard",
+                        help="encfs options for new volumes")
+    parser.add_argument("--registry", help="path of the volume registry")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.INFO)
+    registry = VolumeRegistry(args.registry) if args.registry else None
+    daemon = PyEncfsDaemon(args.socket, args.options, registry)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except OSError as err:
+        daemon.log.error("Failed to listen on %s: %s", args.socket, err)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
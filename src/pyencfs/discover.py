@@ -0,0 +1,95 @@
+import logging
+import os
+
+import psutil
+
+from .config import read_config, CONFIG_FILE
+from .scan import scantree
+
+
+log = logging.getLogger(__name__)
+
+# encfs options followed by a separate value argument
+_VALUE_OPTIONS = {"-o", "-i", "--idle", "--extpass", "-c", "--config"}
+
+
+def _encfs_arguments(cmdline):
+    """Root directory and mount point from an encfs command line"""
+    positional = []
+    args = iter(cmdline[1:])
+    for arg in args:
+        if arg in _VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith("-"):
+            positional.append(arg)
+    if len(positional) < 2:
+        return None
+    return positional[0], positional[1]
+
+
+def encfs_mounts():
+    """Map encfs root directories to their current mount points
+
+    encfs mounts show up as device "encfs" in the mount table, which does
+    not tell the encrypted directory. The directory is taken from the
+    command lines of the running encfs processes instead, read in a single
+    pass over the process table.
+
+    Returns:
+    ========
+    dict of absolute root directory -> mount point of all mounted volumes
+    """
+    mountpoints = set()
+    for part in psutil.disk_partitions(True):
+        if str(part.device) == "encfs" and str(part.fstype) == "fuse.encfs":
+            mountpoints.add(str(part.mountpoint))
+    mounts = {}
+    for proc in psutil.process_iter(["name", "cmdline", "cwd"]):
+        if proc.info["name"] != "encfs" or not proc.info["cmdline"]:
+            continue
+        args = _encfs_arguments(proc.info["cmdline"])
+        if args is None:
+            continue
+        cwd = proc.info["cwd"] or "/"
+        root, mountpoint = (os.path.normpath(os.path.join(cwd, a))
+                            for a in args)
+        if mountpoint in mountpoints:
+            mounts[root] = mountpoint
+    return mounts
+
+
+def discover_volumes(root, workers=None):
+    """Find all encfs volumes below a directory
+
+    Walks the directory tree with parallel scandir workers looking for
+    encfs configuration files. The encrypted tree of a volume found is
+    not descended into. Results are yielded as soon as they are found.
+
+    Parameters:
+    ===========
+    root : str
+        directory to search
+    workers : int
+        number of parallel scandir workers
+
+    Returns:
+    ========
+    generator of dicts with "path_encrypted", "config" (see
+    config.read_config), "mounted" and "path_decrypted" (mount point or
+    None) of every volume
+    """
+    mounts = encfs_mounts()
+    for path, dirs, files in scantree(root, workers):
+        if not any(entry.name == CONFIG_FILE for entry in files):
+            continue
+        dirs.clear()
+        path_encrypted = os.path.abspath(path)
+        config = read_config(path_encrypted)
+        if config is None:
+            log.warning("Unable to parse encfs configuration in %s", path)
+            continue
+        path_decrypted = mounts.get(path_encrypted)
+        yield {"path_encrypted": path_encrypted,
+               "config": config,
+               "mounted": path_decrypted is not None,
+               "path_decrypted": path_decrypted}
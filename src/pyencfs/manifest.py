@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from .scan import scantree, _default_workers
+
+
+class Manifest():
+    """Change manifest of an encrypted encfs directory
+
+    Records size, modification time, inode and optionally a content hash
+    of every file within the encrypted directory in a SQLite index. Each
+    update walks the directory in parallel and reports the files added,
+    changed and removed since the previous update, so replication only
+    needs to transfer the change set.
+    """
+
+    def __init__(self, path_encrypted, path_index=None, hashing=False,
+                 workers=None):
+        """Open (or create) the manifest index of an encrypted directory
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+        path_index : str
+            path to the SQLite index file, defaults to
+            "<path_encrypted>.manifest" next to the encrypted directory
+        hashing : bool
+            compute sha256 content hashes of added and changed files
+        workers : int
+            number of parallel scandir and hashing workers
+        """
+        self.name = "Manifest"
+        self.log = logging.getLogger(__name__ + "." + self.name)
+        self.path_encrypted = os.path.normpath(str(path_encrypted))
+        if path_index is None:
+            path_index = self.path_encrypted + ".manifest"
+        self.path_index = str(path_index)
+        self.hashing = hashing
+        self.workers = workers or _default_workers()
+        self.db = sqlite3.connect(self.path_index)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, "
+                        "size INTEGER, "
+                        "mtime_ns INTEGER, "
+                        "inode INTEGER, "
+                        "hash TEXT)")
+        self.db.commit()
+        self.log.debug("Opened manifest index %s for %s",
+                       self.path_index, self.path_encrypted)
+
+    def close(self):
+        """Close the manifest index"""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _hash(self, path):
+        """sha256 hex digest of the file content at the given path
+
+        Returns None if the file vanished since it was scanned.
+        """
+        h = hashlib.sha256()
+        try:
+            with open(os.path.join(self.path_encrypted, path), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        except FileNotFoundError:
+            self.log.warning("File vanished during scan %s", path)
+            return None
+        return h.hexdigest()
+
+    def _rel(self, path):
+        """Path relative to the encrypted directory with "/" separators"""
+        return os.path.relpath(path, self.path_encrypted).replace(os.sep, "/")
+
+    def _walk(self, failed):
+        """Yield (path, size, mtime_ns, inode) of all encrypted files
+
+        Paths are relative to the encrypted directory and use "/" as
+        separator. Relative paths of directories and files which could
+        not be read are added to failed.
+        """
+
+        def _onerror(path, err):
+            self.log.warning("Failed to read %s: %s", path, err)
+            failed.add(self._rel(path))
+
+        for root, dirs, files in scantree(self.path_encrypted,
+                                          self.workers, _onerror):
+            for entry in files:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    self.log.warning("File vanished during scan %s",
+                                     entry.path)
+                    continue
+                except OSError as err:
+                    _onerror(entry.path, err)
+                    continue
+                yield (self._rel(entry.path), st.st_size,
+                       st.st_mtime_ns, st.st_ino)
+
+    def update(self, commit=True):
+        """Scan the encrypted directory and compute changes to the index
+
+        Parameters:
+        ===========
+        commit : bool
+            store the new state in the index, use False for a dry run
+
+        Returns:
+        ========
+        dict with sorted lists of relative paths "added", "changed" and
+        "removed"
+
+        Files below directories which could not be read are neither
+        reported as removed nor removed from the index. Files vanishing
+        while they are hashed are left out, the next update picks them up.
+        """
+        added = []
+        changed = []
+        failed = set()
+        db = self.db
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS seen "
+                   "(path TEXT PRIMARY KEY)")
+        db.execute("DELETE FROM seen")
+        rows = []
+        for path, size, mtime_ns, inode in self._walk(failed):
+            db.execute("INSERT OR IGNORE INTO seen VALUES (?)", (path,))
+            old = db.execute("SELECT size, mtime_ns, inode FROM files "
+                             "WHERE path = ?", (path,)).fetchone()
+            if old is None:
+                added.append(path)
+            elif old != (size, mtime_ns, inode):
+                changed.append(path)
+            else:
+                continue
+            rows.append((path, size, mtime_ns, inode))
+        removed = [r[0] for r in db.execute(
+            "SELECT path FROM files WHERE path NOT IN "
+            "(SELECT path FROM seen)")]
+        if failed:
+            self.log.warning("Keeping index entries below %d unreadable "
+                             "paths", len(failed))
+            removed = [p for p in removed
+                       if not any(f == "." or p == f or
+                                  p.startswith(f + "/") for f in failed)]
+
+        hashes = [None] * len(rows)
+        if self.hashing and rows:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                hashes = list(pool.map(self._hash, [r[0] for r in rows]))
+            vanished = set(r[0] for r, h in zip(rows, hashes) if h is None)
+            if vanished:
+                rows = [r for r in rows if r[0] not in vanished]
+                hashes = [h for h in hashes if h is not None]
+                added = [p for p in added if p not in vanished]
+                changed = [p for p in changed if p not in vanished]
+
+        if commit:
+            db.executemany("INSERT OR REPLACE INTO files VALUES "
+                           "(?, ?, ?, ?, ?)",
+                           [r + (h,) for r, h in zip(rows, hashes)])
+            db.executemany("DELETE FROM files WHERE path = ?",
+                           [(p,) for p in removed])
+        db.execute("DELETE FROM seen")
+        db.commit()
+        self.log.info("Manifest of %s: %d added, %d changed, %d removed",
+                      self.path_encrypted, len(added), len(changed),
+                      len(removed))
+        return {"added": sorted(added),
+                "changed": sorted(changed),
+                "removed": sorted(removed)}
+
+    def hash(self, path):
+        """Content hash recorded for a file in the index
+
+        Parameters:
+        ===========
+        path : str
+            path relative to the encrypted directory
+
+        Returns:
+        ========
+        sha256 hex digest or None if no hash was recorded
+        """
+        row = self.db.execute("SELECT hash FROM files WHERE path = ?",
+                              (path,)).fetchone()
+        return row[0] if row else None
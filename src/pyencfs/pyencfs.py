@@ -1,9 +1,39 @@
+import contextlib
+import fcntl
+import functools
+import hashlib
 import logging
 import subprocess
 import os
 import pathlib
+import shutil
+import stat
+import tempfile
+import threading
+import time
 import psutil
 
+from .blockers import find_blockers
+from .copytree import copy_tree, compare_trees, exchange_paths, clone_file
+from .discover import encfs_mounts
+from .registry import MOUNTED, UNMOUNTED
+from .scrub import Scrubber
+
+
+class _LockError(Exception):
+    """Failure to acquire the lock files of an operation"""
+
+
+def _locking(method):
+    """Return False from a locking method if its locks cannot be acquired"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except _LockError:
+            return False
+    return wrapper
+
 
 class PyEncfs():
     """Create, Mount and Unmount Encfs file systems
@@ -12,11 +42,38 @@ class PyEncfs():
     using system.run shell excecution.
     """
 
-    def __init__(self, options="--standard"):
+    def __init__(self, options="--standard", registry=None, lockdir=None):
+        """Check for required commands
+
+        Parameters:
+        ===========
+        options : str
+            encfs options used to create new volumes
+        registry : VolumeRegistry
+            registry to record volume changes in, None disables recording
+        lockdir : str
+            directory for the per volume lock files, must be owned by the
+            current user and not writable by others, defaults to
+            "pyencfs-locks" in $XDG_RUNTIME_DIR or "pyencfs-locks-<uid>"
+            in the temporary directory
+        """
         self.name = "Encfs"
         self.log = logging.getLogger(__name__ + "." + self.name)
         self.log.debug("Initializing encfs")
         self.options = options
+        self.registry = registry
+        self._leases = {}
+        self._draining = set()
+        self._lease_lock = threading.Lock()
+        if lockdir is None:
+            if os.environ.get("XDG_RUNTIME_DIR"):
+                lockdir = os.path.join(os.environ["XDG_RUNTIME_DIR"],
+                                       "pyencfs-locks")
+            else:
+                lockdir = os.path.join(tempfile.gettempdir(),
+                                       "pyencfs-locks-%d" % os.getuid())
+        self.lockdir = str(lockdir)
+        self._held = threading.local()
         cmdok = True
         for c in ["echo", "encfs", "encfsctl", "fusermount"]:
             cmdok = cmdok and self._check_command(c)
@@ -65,6 +122,9 @@ class PyEncfs():
     def _isencfsmount(self, path):
         """Check if a given mount point is an encfs mount point
 
+        Regular and reverse encfs mounts are both reported as device
+        "encfs" of type "fuse.encfs" and are both accepted.
+
         Parameters:
         ===========
         path : str
@@ -97,6 +157,81 @@ class PyEncfs():
         self.log.error("Error identifying mount point!")
         return False
 
+    @contextlib.contextmanager
+    def _lock(self, *paths):
+        """Hold exclusive advisory locks of the given paths
+
+        Serializes state changing operations (create, mount, umount, ...)
+        on the same paths across threads and processes using flock on one
+        lock file per path in the lock directory. Locks are acquired in a
+        fixed order to avoid dead locks and are reentrant within a thread.
+        Read only operations do not lock. Failures to acquire the locks
+        are logged and raised as _LockError, which makes methods decorated
+        with _locking return False.
+
+        Parameters:
+        ===========
+        paths : str
+            paths to lock
+        """
+        held = getattr(self._held, "keys", None)
+        if held is None:
+            held = self._held.keys = set()
+        keys = sorted(set(hashlib.sha1(os.fsencode(os.path.realpath(
+            str(p)))).hexdigest() for p in paths) - held)
+        files = []
+        try:
+            try:
+                if keys:
+                    self._checklockdir()
+                for key in keys:
+                    f = open(os.path.join(self.lockdir, key + ".lock"), "a")
+                    files.append(f)
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    held.add(key)
+            except OSError as err:
+                self.log.error("Failed to lock %s in %s: %s",
+                               ", ".join(str(p) for p in paths),
+                               self.lockdir, err)
+                raise _LockError(err)
+            yield
+        finally:
+            for key, f in zip(keys, files):
+                held.discard(key)
+                f.close()
+
+    def _checklockdir(self):
+        """Create the lock directory and make sure only we can write to it
+
+        Raises OSError if the lock directory is a symbolic link, is owned
+        by another user or is writable by group or others.
+        """
+        os.makedirs(self.lockdir, 0o700, exist_ok=True)
+        st = os.lstat(self.lockdir)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+                st.st_mode & 0o022:
+            raise PermissionError("Unsafe lock directory %s" % self.lockdir)
+
+    def _checkunmounted(self, *paths_encrypted):
+        """Check that no encfs process has one of the volumes mounted
+
+        Locks only keep other PyEncfs instances from mounting a volume, so
+        the running encfs processes are checked as well.
+
+        Returns:
+        ========
+        True if none of the volumes is mounted, otherwise False
+        """
+        mounts = encfs_mounts()
+        for path in paths_encrypted:
+            for key in {os.path.abspath(str(path)),
+                        os.path.realpath(str(path))}:
+                if key in mounts:
+                    self.log.error("Volume %s is mounted at %s, unmount it "
+                                   "first!", path, mounts[key])
+                    return False
+        return True
+
     def _createpath(self, path):
         """Create given directory path
 
@@ -140,6 +275,7 @@ class PyEncfs():
                 return False
         return True
 
+    @_locking
     def create(self, path_encrypted, path_decrypted, password):
         """Create an encrypted encfs directory
 
@@ -162,15 +298,17 @@ class PyEncfs():
         --------
         True on success and False on failure
         """
-        if self._createpath(path_encrypted) and \
-                self._createpath(path_decrypted):
-            return self.mount(path_encrypted, path_decrypted, password)
-        else:
-            self.log.error("Failed to create new Encfs file system / "
-                           "directory!")
-            return False
+        with self._lock(path_encrypted, path_decrypted):
+            if self._createpath(path_encrypted) and \
+                    self._createpath(path_decrypted):
+                return self.mount(path_encrypted, path_decrypted, password)
+            else:
+                self.log.error("Failed to create new Encfs file system / "
+                               "directory!")
+                return False
 
-    def mount(self, path_encrypted, path_decrypted, password):
+    @_locking
+    def mount(self, path_encrypted, path_decrypted, password, record=True):
         """Try to mount a given path as encfs file system.
 
         This method tries to run a shell command to mount a given path
@@ -187,36 +325,209 @@ class PyEncfs():
             must not exist or must be empty!
         password : str
             Password to encrypt / decrypt files within encfs
+        record : bool
+            record the mount in the registry, internal temporary mounts
+            pass False
 
         Returns:
         --------
         True on success and False on failure
         """
-
-        if self._createpath(path_decrypted) and \
-                os.path.isdir(str(path_encrypted)):
-            try:
-                subprocess.run("echo '" + str(password) + "' | " +
-                               "encfs " + self.options + " --stdinpass '" +
-                               str(path_encrypted) + "' '" +
-                               str(path_decrypted) + "'", shell=True)
-            except Exception:
-                self.log.exception("Non-zero return value from encfs mount "
-                                   "cmd")
-                return False
-            if os.path.ismount(str(path_decrypted)) and \
-                    self._isencfsmount(path_decrypted):
-                self.log.info("Encfs successfully mounted from "
-                              "%s to %s!", path_encrypted, path_decrypted)
-                return True
+        with self._lock(path_encrypted, path_decrypted):
+            if self._createpath(path_decrypted) and \
+                    os.path.isdir(str(path_encrypted)):
+                return self._mount(path_encrypted, path_decrypted, password,
+                                   self.options, record)
             else:
-                self.log.error("Failed to detect valid mount point at "
-                               "path_decrypted! %s", path_decrypted)
+                self.log.error("Failed to mount encfs file system!")
                 return False
+
+    def _mount(self, source, target, password, options, record=True):
+        """Run the encfs mount command and check the resulting mount point
+
+        Parameters:
+        ===========
+        source : str
+            encfs root directory (encrypted directory, or plain directory
+            for reverse mounts)
+        target : str
+            mount point to mount the encfs view to
+        password : str
+            Password to encrypt / decrypt files within encfs
+        options : str
+            encfs command line options to use for the mount
+        record : bool
+            record the mount in the registry
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        # encfs resolves relative paths against its working directory,
+        # which is "/" after it daemonized; absolute paths also keep the
+        # process command line usable by discover.encfs_mounts
+        source = os.path.abspath(str(source))
+        target = os.path.abspath(str(target))
+        try:
+            subprocess.run("echo '" + str(password) + "' | " +
+                           "encfs " + options + " --stdinpass '" +
+                           str(source) + "' '" +
+                           str(target) + "'", shell=True)
+        except Exception:
+            self.log.exception("Non-zero return value from encfs mount "
+                               "cmd")
+            return False
+        if os.path.ismount(str(target)) and \
+                self._isencfsmount(target):
+            self.log.info("Encfs successfully mounted from "
+                          "%s to %s!", source, target)
+            if record and self.registry is not None:
+                self.registry.record(source, target, options, MOUNTED)
+            return True
         else:
-            self.log.error("Failed to mount encfs file system!")
+            self.log.error("Failed to detect valid mount point at "
+                           "path_decrypted! %s", target)
             return False
 
+    @_locking
+    def create_reverse(self, path_plain, path_view, password):
+        """Create a reverse encfs configuration and mount encrypted view
+
+        encfs --reverse stores its configuration within the plain directory
+        and mounts an encrypted, read-only view of the plain files. This
+        allows encrypted backups of plain data without keeping a second,
+        encrypted copy on disk.
+
+        Parameters:
+        -----------
+        path_plain : str
+            path to the existing plain directory to encrypt
+        path_view : str
+            path to the mount point for the encrypted view
+            must not exist or must be empty!
+        password : str
+            Password to encrypt / decrypt files within encfs
+
+        Returns:
+        --------
+        True on success and False on failure
+        """
+        with self._lock(path_plain, path_view):
+            if os.path.exists(os.path.join(str(path_plain), ".encfs6.xml")):
+                self.log.error("Reverse encfs configuration exists already! "
+                               "%s", path_plain)
+                return False
+            return self.mount_reverse(path_plain, path_view, password)
+
+    @_locking
+    def mount_reverse(self, path_plain, path_view, password, record=True):
+        """Mount an encrypted view of a plain directory (encfs --reverse)
+
+        If the plain directory does not hold a reverse configuration yet,
+        encfs creates it using the options given to PyEncfs. Note that
+        --paranoia volumes cannot be used in reverse mode by encfs.
+
+        Parameters:
+        -----------
+        path_plain : str
+            path to the existing plain directory to encrypt
+        path_view : str
+            path to the mount point for the encrypted view
+            must not exist or must be empty!
+        password : str
+            Password to encrypt / decrypt files within encfs
+        record : bool
+            record the mount in the registry, internal temporary mounts
+            pass False
+
+        Returns:
+        --------
+        True on success and False on failure
+        """
+        with self._lock(path_plain, path_view):
+            if "--paranoia" in self.options:
+                self.log.warning("encfs does not support reverse mode with "
+                                 "--paranoia options!")
+            if self._createpath(path_view) and \
+                    os.path.isdir(str(path_plain)):
+                return self._mount(path_plain, path_view, password,
+                                   "--reverse " + self.options, record)
+            else:
+                self.log.error("Failed to mount reverse encfs file system!")
+                return False
+
+    @_locking
+    def backup_reverse(self, path_plain, path_view, path_target, password):
+        """Copy the encrypted view of a plain directory to a backup target
+
+        Mounts the reverse view of path_plain to path_view, streams all
+        encrypted files into path_target and unmounts the view afterwards.
+        Files in path_target with identical size and modification time are
+        skipped, so repeated backups only copy changed files. Files and
+        directories in path_target which no longer exist in the view are
+        removed, so path_target mirrors the current plain directory.
+
+        Parameters:
+        -----------
+        path_plain : str
+            path to the existing plain directory to back up
+        path_view : str
+            temporary mount point for the encrypted view
+            must not exist or must be empty!
+        path_target : str
+            directory receiving the encrypted files
+        password : str
+            Password to encrypt / decrypt files within encfs
+
+        Returns:
+        --------
+        True on success and False on failure
+        """
+        with self._lock(path_plain, path_view, path_target):
+            if not self.mount_reverse(path_plain, path_view, password,
+                                      record=False):
+                return False
+            ok = True
+
+            def _raise(err):
+                raise err
+
+            try:
+                # errors reading the view must not look like deleted files
+                for root, dirs, files in os.walk(str(path_view),
+                                                 onerror=_raise):
+                    rel = os.path.relpath(root, str(path_view))
+                    dst_root = os.path.normpath(
+                            os.path.join(str(path_target), rel))
+                    os.makedirs(dst_root, exist_ok=True)
+                    for name in set(os.listdir(dst_root)) - set(dirs + files):
+                        stale = os.path.join(dst_root, name)
+                        if os.path.isdir(stale) and not os.path.islink(stale):
+                            shutil.rmtree(stale)
+                        else:
+                            os.remove(stale)
+                    for f in files:
+                        src = os.path.join(root, f)
+                        dst = os.path.join(dst_root, f)
+                        st = os.stat(src)
+                        if os.path.exists(dst):
+                            dst_st = os.stat(dst)
+                            if dst_st.st_size == st.st_size and \
+                                    int(dst_st.st_mtime) == int(st.st_mtime):
+                                continue
+                        shutil.copy2(src, dst)
+            except Exception:
+                self.log.exception("Failed to copy encrypted view to backup "
+                                   "target %s!", path_target)
+                ok = False
+            if not self.umount(path_view):
+                return False
+            if ok:
+                self.log.info("Encrypted backup of %s written to %s!",
+                              path_plain, path_target)
+            return ok
+
+    @_locking
     def umount(self, path):
         """Unmount file system using "fusermount -u <path>"
 
@@ -232,27 +543,122 @@ class PyEncfs():
         ========
         True on success and False on failure
         """
-        if not os.path.ismount(str(path)):
-            self.log.warning("Given path is not a mount point! "
-                             "Nothing to unmount at %s.", path)
-            return False
-        if not self._isencfsmount(path):
-            self.log.warning("Refusing to unmount none encfs fstype!")
-            return False
+        with self._lock(path):
+            if not os.path.ismount(str(path)):
+                self.log.warning("Given path is not a mount point! "
+                                 "Nothing to unmount at %s.", path)
+                return False
+            if not self._isencfsmount(path):
+                self.log.warning("Refusing to unmount none encfs fstype!")
+                return False
+
+            try:
+                ret = subprocess.run("fusermount -u '" + str(path) + "'",
+                                     shell=True)
+            except Exception:
+                self.log.exception("Non-zero return value from passwd "
+                                   "check command")
+                return False
+            if os.path.ismount(str(path)) or ret.returncode != 0:
+                self.log.error("Failed to unmount path! %s", path)
+                for b in find_blockers(path):
+                    self.log.error("Mount point %s busy by pid %d (%s): %s",
+                                   path, b["pid"], b["name"],
+                                   ", ".join(b["reasons"]))
+                return False
+            else:
+                if self.registry is not None:
+                    self.registry.unmounted(path)
+                return True
+
+    def acquire_lease(self, path):
+        """Register a user of a mounted volume
+
+        Leases keep drain_and_umount from unmounting a volume while it is
+        in use by this process. No new leases are handed out while a
+        volume is drained.
+
+        Parameters:
+        ===========
+        path : str
+            mount point of the volume
+
+        Returns:
+        ========
+        True if the lease was acquired, False if the volume is draining or
+        not mounted
+        """
+        path = os.path.abspath(str(path))
+        with self._lease_lock:
+            if path in self._draining:
+                self.log.warning("Volume is draining, no new leases! %s",
+                                 path)
+                return False
+            if not os.path.ismount(path):
+                self.log.error("Given path is no mount point! %s", path)
+                return False
+            self._leases[path] = self._leases.get(path, 0) + 1
+        return True
+
+    def release_lease(self, path):
+        """Release a lease acquired with acquire_lease
+
+        Parameters:
+        ===========
+        path : str
+            mount point of the volume
+        """
+        path = os.path.abspath(str(path))
+        with self._lease_lock:
+            count = self._leases.get(path, 0) - 1
+            if count > 0:
+                self._leases[path] = count
+            else:
+                self._leases.pop(path, None)
+
+    def drain_and_umount(self, path, timeout=30, interval=0.2):
+        """Wait for all users of a volume to finish and unmount it
+
+        Stops handing out new leases for the volume, then waits until all
+        leases are released and no process uses the mount point anymore,
+        and unmounts the volume. Gives up when the timeout expires.
+
+        Parameters:
+        ===========
+        path : str
+            mount point of the volume
+        timeout : float
+            maximum number of seconds to wait
+        interval : float
+            seconds between checks
 
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        path = os.path.abspath(str(path))
+        deadline = time.monotonic() + timeout
+        with self._lease_lock:
+            self._draining.add(path)
         try:
-            ret = subprocess.run("fusermount -u '" + str(path) + "'",
-                                 shell=True)
-        except Exception:
-            self.log.exception("Non-zero return value from passwd "
-                               "check command")
-            return False
-        if os.path.ismount(str(path)) or ret.returncode != 0:
-            self.log.error("Failed to unmount path! %s", path)
-            return False
-        else:
-            return True
+            while True:
+                with self._lease_lock:
+                    leases = self._leases.get(path, 0)
+                blockers = [] if leases else find_blockers(path)
+                if not leases and not blockers:
+                    break
+                if time.monotonic() >= deadline:
+                    self.log.error("Timeout draining %s: %d leases, "
+                                   "blocked by pids %s", path, leases,
+                                   [b["pid"] for b in blockers])
+                    return False
+                time.sleep(interval)
+            return self.umount(path)
+        finally:
+            with self._lease_lock:
+                self._draining.discard(path)
 
+    @_locking
     def change_password(self, path_encrypted, password_current, password_new):
         """Change the password for the encfs file system to a new password
 
@@ -269,29 +675,32 @@ class PyEncfs():
         ========
         True on success and False on failure
         """
-        ret = None
-        try:
-            ret = subprocess.run("echo '" + str(password_current) +
-                                 "\n" + str(password_new) + "' | " +
-                                 "encfsctl autopasswd '" +
-                                 str(path_encrypted) + "'",
-                                 shell=True, capture_output=True)
-        except Exception:
-            self.log.exception("Non-zero return value from passwd "
-                               "check command")
-            return False
+        with self._lock(path_encrypted):
+            ret = None
+            try:
+                ret = subprocess.run("echo '" + str(password_current) +
+                                     "\n" + str(password_new) + "' | " +
+                                     "encfsctl autopasswd '" +
+                                     str(path_encrypted) + "'",
+                                     shell=True, capture_output=True)
+            except Exception:
+                self.log.exception("Non-zero return value from passwd "
+                                   "check command")
+                return False
 
-        if b'Volume Key successfully updated' not in ret.stdout and \
-                ret.returncode == 1:
-            self.log.error("Failed to change password!")
-            return False
+            if b'Volume Key successfully updated' not in ret.stdout and \
+                    ret.returncode == 1:
+                self.log.error("Failed to change password!")
+                return False
 
-        if self.check_password(path_encrypted, password_new):
-            self.log.debug("Password successfully changed!")
-            return True
-        else:
-            self.log.error("Unexpected happened")
-            return False
+            if self.check_password(path_encrypted, password_new):
+                self.log.debug("Password successfully changed!")
+                if self.registry is not None:
+                    self.registry.record(path_encrypted)
+                return True
+            else:
+                self.log.error("Unexpected happened")
+                return False
 
     def check_password(self, path_encrypted, password):
         """Change the password for the encfs file system to a new password
@@ -358,3 +767,232 @@ class PyEncfs():
             return True
         else:
             return False
+
+    def scrub(self, path_encrypted, path_decrypted, password=None,
+              workers=None, rate=None, checkpoint=None):
+        """Verify every block of an encfs volume (MACs of --paranoia volumes)
+
+        Reads all files block by block through the encfs mount with several
+        workers. If path_decrypted is not mounted yet and a password is
+        given, the volume is mounted for the scrub and unmounted afterwards.
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+        path_decrypted : str
+            path to the decryption mount point
+        password : str
+            Password to mount the volume if it is not mounted
+        workers : int
+            number of files verified in parallel
+        rate : int
+            maximum number of bytes read per second, None for no limit
+        checkpoint : str
+            path to a checkpoint file to continue interrupted scrubs
+
+        Returns:
+        ========
+        list of corrupted blocks (see Scrubber.run), None on failure
+        """
+        mounted = False
+        if not os.path.ismount(str(path_decrypted)):
+            if password is None:
+                self.log.error("Volume is not mounted and no password "
+                               "given! %s", path_decrypted)
+                return None
+            if not self.mount(path_encrypted, path_decrypted, password,
+                              record=False):
+                return None
+            mounted = True
+        elif not self._isencfsmount(path_decrypted):
+            return None
+        errors = Scrubber(path_encrypted, path_decrypted, workers,
+                          rate, checkpoint).run()
+        if mounted and not self.umount(path_decrypted):
+            self.log.error("Failed to unmount volume after scrub! %s",
+                           path_decrypted)
+        return errors
+
+    @_locking
+    def rekey_volume(self, old_encrypted, old_password, new_encrypted,
+                     new_password, profile=None, workers=None,
+                     journal=None):
+        """Re-encrypt a volume with a new volume key
+
+        change_password only re-wraps the existing volume key. This method
+        creates a new volume with a new key and copies every file from the
+        old volume into it. Files are copied in parallel with bounded
+        memory per file, and each copied file is recorded in a journal, so
+        an interrupted re-key continues with the files not copied yet.
+        After copying, the content of both volumes is compared and the
+        encrypted directories are exchanged: old_encrypted then holds the
+        re-keyed volume and new_encrypted the previous one. The re-key is
+        refused if one of the volumes is mounted, before copying as well as
+        before the exchange.
+
+        Parameters:
+        ===========
+        old_encrypted : str
+            path to the encrypted directory of the volume to re-key
+        old_password : str
+            password of the volume to re-key
+        new_encrypted : str
+            path to the encrypted directory of the new volume
+            must not exist or must be empty, or hold an interrupted re-key
+        new_password : str
+            password of the new volume
+        profile : str
+            encfs options for the new volume, defaults to the options of
+            this PyEncfs instance
+        workers : int
+            number of files copied in parallel
+        journal : str
+            path of the journal file, defaults to
+            "<new_encrypted>.rekey-journal"
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        with self._lock(old_encrypted, new_encrypted):
+            if not self._checkunmounted(old_encrypted, new_encrypted):
+                return False
+            if profile is None:
+                profile = self.options
+            if journal is None:
+                journal = os.path.normpath(str(new_encrypted)) + \
+                    ".rekey-journal"
+            journal = str(journal)
+            done = set()
+            if os.path.exists(journal):
+                with open(journal) as f:
+                    done = set(line.rstrip("\n") for line in f
+                               if line.endswith("\n"))
+                self.log.info("Continuing re-key, %d files copied already",
+                              len(done))
+            elif not self._createpath(new_encrypted):
+                self.log.error("Failed to create new volume for re-key!")
+                return False
+
+            old_mount = tempfile.mkdtemp(prefix="pyencfs-rekey-")
+            new_mount = tempfile.mkdtemp(prefix="pyencfs-rekey-")
+            ok = False
+            try:
+                if not self.mount(old_encrypted, old_mount, old_password,
+                                  record=False):
+                    return False
+                if not self._mount(new_encrypted, new_mount, new_password,
+                                   profile, record=False):
+                    self.umount(old_mount)
+                    return False
+                lock = threading.Lock()
+                with open(journal, "a") as j:
+
+                    def _journal(rel):
+                        with lock:
+                            j.write(rel + "\n")
+                            j.flush()
+
+                    copy_tree(old_mount, new_mount, workers, done, _journal)
+                differ = compare_trees(old_mount, new_mount, workers)
+                if differ:
+                    self.log.error("Re-keyed volume differs in %d files, "
+                                   "e.g. %s", len(differ), differ[0])
+                else:
+                    ok = True
+            except Exception:
+                self.log.exception("Failed to copy files for re-key!")
+            finally:
+                for path in (old_mount, new_mount):
+                    if os.path.ismount(path) and not self.umount(path):
+                        ok = False
+                for path in (old_mount, new_mount):
+                    if not os.path.ismount(path):
+                        os.rmdir(path)
+            if not ok:
+                return False
+            # writes through a mount made meanwhile would be lost, and its
+            # encfs process would serve the re-keyed files with the old key
+            if not self._checkunmounted(old_encrypted, new_encrypted):
+                return False
+            try:
+                exchange_paths(old_encrypted, new_encrypted)
+            except OSError:
+                self.log.exception("Failed to exchange encrypted directories!")
+                return False
+            if self.registry is not None:
+                previous = self.registry.get(old_encrypted)
+                self.registry.record(
+                        new_encrypted,
+                        profile=previous["profile"] if previous else None,
+                        state=UNMOUNTED)
+                self.registry.record(old_encrypted, profile=profile)
+            os.remove(journal)
+            self.log.info("Volume %s re-keyed, previous volume moved to %s",
+                          old_encrypted, new_encrypted)
+            return True
+
+    @_locking
+    def clone_volume(self, src_encrypted, dst_encrypted, new_password=None,
+                     password=None, workers=None):
+        """Clone an encrypted directory into a new volume
+
+        Copies the encrypted files including the configuration, so the
+        clone shares the volume key with the source. Files are copied in
+        parallel using reflinks where the file system supports them, which
+        makes the clone near-instant on btrfs or xfs. Optionally the
+        password of the clone is changed afterwards.
+
+        Parameters:
+        ===========
+        src_encrypted : str
+            path to the encrypted directory to clone, should not be in use
+        dst_encrypted : str
+            path to the encrypted directory of the clone
+            must not exist or must be empty!
+        new_password : str
+            new password of the clone, None keeps the source password. The
+            clone is removed again if the password cannot be changed
+        password : str
+            current password of the source, required with new_password
+        workers : int
+            number of files copied in parallel
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        with self._lock(dst_encrypted):
+            if new_password is not None and password is None:
+                self.log.error("Current password required to change password "
+                               "of clone!")
+                return False
+            if not os.path.isfile(os.path.join(str(src_encrypted),
+                                               ".encfs6.xml")):
+                self.log.error("No encfs configuration found in %s!",
+                               src_encrypted)
+                return False
+            if not self._createpath(dst_encrypted):
+                self.log.error("Failed to create clone directory!")
+                return False
+            try:
+                copy_tree(src_encrypted, dst_encrypted, workers,
+                          copy=clone_file)
+            except Exception:
+                self.log.exception("Failed to copy encrypted files for clone!")
+                shutil.rmtree(str(dst_encrypted), ignore_errors=True)
+                return False
+            if new_password is not None and \
+                    not self.change_password(dst_encrypted, password,
+                                             new_password):
+                # the clone still opens with the source password
+                self.log.error("Failed to change password of clone, "
+                               "removing %s!", dst_encrypted)
+                shutil.rmtree(str(dst_encrypted), ignore_errors=True)
+                return False
+            self.log.info("Cloned volume %s to %s", src_encrypted,
+                          dst_encrypted)
+            if self.registry is not None:
+                self.registry.record(dst_encrypted, state=UNMOUNTED)
+            return True
@@ -0,0 +1,174 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import psutil
+
+
+MOUNTED = "mounted"
+UNMOUNTED = "unmounted"
+
+
+class VolumeRegistry():
+    """Persistent registry of encfs volumes managed by PyEncfs
+
+    Keeps encrypted path, mount point, encfs options and the last known
+    state of every volume in a SQLite database. PyEncfs updates the
+    registry on create, mount, umount and change_password. After a restart
+    reconcile() compares the registry against the mount table in a single
+    pass instead of checking every volume on its own.
+    """
+
+    def __init__(self, path):
+        """Open (or create) the registry database
+
+        Parameters:
+        ===========
+        path : str
+            path to the SQLite database file
+        """
+        self.name = "VolumeRegistry"
+        self.log = logging.getLogger(__name__ + "." + self.name)
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=30,
+                                  check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS volumes ("
+                            "path_encrypted TEXT PRIMARY KEY, "
+                            "path_decrypted TEXT, "
+                            "profile TEXT, "
+                            "state TEXT, "
+                            "updated REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS volumes_decrypted "
+                            "ON volumes (path_decrypted)")
+
+    def close(self):
+        """Close the registry database"""
+        self.db.close()
+
+    @staticmethod
+    def _row(row):
+        return {"path_encrypted": row[0],
+                "path_decrypted": row[1],
+                "profile": row[2],
+                "state": row[3],
+                "updated": row[4]}
+
+    def record(self, path_encrypted, path_decrypted=None, profile=None,
+               state=None):
+        """Add or update a volume
+
+        Values given as None keep their previously recorded value.
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+        path_decrypted : str
+            mount point of the volume
+        profile : str
+            encfs options of the volume
+        state : str
+            MOUNTED or UNMOUNTED
+        """
+        path_encrypted = os.path.abspath(str(path_encrypted))
+        if path_decrypted is not None:
+            path_decrypted = os.path.abspath(str(path_decrypted))
+        with self.lock, self.db:
+            self.db.execute(
+                    "INSERT INTO volumes VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path_encrypted) DO UPDATE SET "
+                    "path_decrypted = "
+                    "coalesce(excluded.path_decrypted, path_decrypted), "
+                    "profile = coalesce(excluded.profile, profile), "
+                    "state = coalesce(excluded.state, state), "
+                    "updated = excluded.updated",
+                    (path_encrypted, path_decrypted, profile, state,
+                     time.time()))
+        self.log.debug("Recorded volume %s state=%s", path_encrypted, state)
+
+    def unmounted(self, path_decrypted):
+        """Mark the volume mounted at the given mount point as unmounted
+
+        Parameters:
+        ===========
+        path_decrypted : str
+            mount point of the volume
+        """
+        with self.lock, self.db:
+            self.db.execute("UPDATE volumes SET state = ?, updated = ? "
+                            "WHERE path_decrypted = ?",
+                            (UNMOUNTED, time.time(),
+                             os.path.abspath(str(path_decrypted))))
+
+    def remove(self, path_encrypted):
+        """Remove a volume from the registry
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM volumes WHERE path_encrypted = ?",
+                            (os.path.abspath(str(path_encrypted)),))
+
+    def get(self, path_encrypted):
+        """Recorded information of a volume
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+
+        Returns:
+        ========
+        dict with the recorded values or None for unknown volumes
+        """
+        with self.lock:
+            row = self.db.execute(
+                    "SELECT * FROM volumes WHERE path_encrypted = ?",
+                    (os.path.abspath(str(path_encrypted)),)).fetchone()
+        return self._row(row) if row else None
+
+    def volumes(self):
+        """List of all recorded volumes as dicts"""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM volumes "
+                                   "ORDER BY path_encrypted").fetchall()
+        return [self._row(row) for row in rows]
+
+    def reconcile(self):
+        """Update the state of all volumes from the live mount table
+
+        Reads the mount table once and marks every volume as mounted if an
+        encfs file system is mounted at its mount point, otherwise as
+        unmounted.
+
+        Returns:
+        ========
+        list of all volumes as dicts with updated states
+        """
+        mounts = set()
+        for part in psutil.disk_partitions(True):
+            if str(part.device) == "encfs" and \
+                    str(part.fstype) == "fuse.encfs":
+                mounts.add(str(part.mountpoint))
+        now = time.time()
+        with self.lock, self.db:
+            rows = self.db.execute("SELECT path_encrypted, path_decrypted, "
+                                   "state FROM volumes").fetchall()
+            updates = []
+            for path_encrypted, path_decrypted, state in rows:
+                live = MOUNTED if path_decrypted in mounts else UNMOUNTED
+                if live != state:
+                    updates.append((live, now, path_encrypted))
+            self.db.executemany("UPDATE volumes SET state = ?, updated = ? "
+                                "WHERE path_encrypted = ?", updates)
+            changed = len(updates)
+        self.log.info("Reconciled volume registry, %d of %d volumes "
+                      "changed state", changed, len(rows))
+        return self.volumes()
@@ -0,0 +1,96 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+log = logging.getLogger(__name__)
+
+
+def _default_workers():
+    """Default number of parallel scandir workers
+
+    Directory scans are dominated by waiting for the file system, so the
+    number of workers exceeds the number of cores.
+    """
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def _scandir(path):
+    """Read a single directory and split entries into dirs and files
+
+    Parameters:
+    ===========
+    path : str
+        directory to read
+
+    Returns:
+    ========
+    tuple (path, dirs, files, errors) with lists of os.DirEntry objects
+    and a list of (path, OSError) tuples of entries which failed
+    """
+    dirs = []
+    files = []
+    errors = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry)
+                    else:
+                        files.append(entry)
+                except OSError as err:
+                    errors.append((entry.path, err))
+    except OSError as err:
+        errors.append((path, err))
+    return path, dirs, files, errors
+
+
+def scantree(root, workers=None, onerror=None):
+    """Walk a directory tree with parallel os.scandir calls
+
+    Works similar to os.walk, but directories are read by a pool of worker
+    threads and results are yielded in no particular order. Like with
+    os.walk, entries removed from the yielded dirs list are not descended
+    into. Directories are visited depth first and at most a few directory
+    reads are in flight per worker, so memory stays bounded by the depth
+    and width of the tree instead of its total size.
+
+    Directories which cannot be read (and entries whose type cannot be
+    determined) are passed to onerror and are missing from the results.
+    onerror is called from the thread consuming the generator, so an
+    exception raised by onerror ends the walk.
+
+    Parameters:
+    ===========
+    root : str
+        directory to walk
+    workers : int
+        number of worker threads, defaults to four per core (at most 32)
+    onerror : callable
+        called with (path, OSError) for every failure, by default failures
+        are logged as warnings
+
+    Returns:
+    ========
+    generator of tuples (dirpath, dirs, files) with lists of os.DirEntry
+    """
+    if workers is None:
+        workers = _default_workers()
+    pending = deque([str(root)])
+    running = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            while pending and len(running) < workers * 2:
+                running.add(pool.submit(_scandir, pending.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, dirs, files, errors = future.result()
+                for error_path, err in errors:
+                    if onerror is None:
+                        log.warning("Failed to read %s: %s", error_path, err)
+                    else:
+                        onerror(error_path, err)
+                yield path, dirs, files
+                pending.extend(d.path for d in dirs)
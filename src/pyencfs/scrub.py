@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .config import read_config, header_size, block_overhead
+from .scan import scantree, _default_workers
+
+
+class _RateLimit():
+    """Token bucket limiting the number of bytes read per second
+
+    Shared by all scrub workers, rate None disables the limit.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.allowance = rate or 0
+        self.last = time.monotonic()
+
+    def consume(self, count):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance +
+                                 (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= count
+            wait_time = -self.allowance / self.rate
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class Scrubber():
+    """Verify all blocks of a mounted encfs volume
+
+    Every file is read block by block through the encfs mount. encfs checks
+    the MAC of each block of --paranoia (MAC) volumes and fails the read
+    with an I/O error on mismatch. Reads through the page cache reach encfs
+    as whole pages plus readahead, so one corrupted block fails the reads
+    of its neighbours too. Failing blocks are therefore read again with
+    O_DIRECT, which passes the exact block range to encfs, and only blocks
+    failing that read are reported. Without O_DIRECT support the reported
+    offsets are only page granular. Progress is appended to a checkpoint
+    file, so an interrupted scrub continues with the files not verified
+    yet.
+    """
+
+    def __init__(self, path_encrypted, path_decrypted, workers=None,
+                 rate=None, checkpoint=None):
+        """Prepare scrubbing of a mounted volume
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory holding the encfs file system
+        path_decrypted : str
+            mount point of the volume
+        workers : int
+            number of files verified in parallel
+        rate : int
+            maximum number of bytes read per second, None for no limit
+        checkpoint : str
+            path to the checkpoint file, None disables checkpointing
+        """
+        self.name = "Scrubber"
+        self.log = logging.getLogger(__name__ + "." + self.name)
+        self.path_encrypted = str(path_encrypted)
+        self.path_decrypted = str(path_decrypted)
+        self.workers = workers or _default_workers()
+        self.limit = _RateLimit(rate)
+        self.checkpoint = checkpoint
+        self.lock = threading.Lock()
+
+    def _load_checkpoint(self):
+        """Read verified files and errors of a previous run"""
+        done = set()
+        errors = []
+        if self.checkpoint is None or \
+                not os.path.exists(str(self.checkpoint)):
+            return done, errors
+        with open(str(self.checkpoint)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line of an interrupted run might be incomplete
+                    continue
+                if "done" in record:
+                    done.add(record["done"])
+                elif "error" in record:
+                    errors.append(record["error"])
+        self.log.info("Continuing scrub, %d files verified already",
+                      len(done))
+        return done, errors
+
+    def _record(self, journal, record):
+        if journal is not None:
+            with self.lock:
+                journal.write(json.dumps(record) + "\n")
+                journal.flush()
+
+    def _failure(self, rel, err):
+        """Error entry of a file or directory which could not be read"""
+        self.log.error("Failed to read %s: %s", rel, err)
+        return {"path": rel, "offset": None, "encrypted_offset": None,
+                "error": err.strerror}
+
+    def _open_direct(self, rel):
+        """Descriptor of rel bypassing the page cache, -1 if unsupported"""
+        try:
+            return os.open(os.path.join(self.path_decrypted, rel),
+                           os.O_RDONLY | os.O_DIRECT)
+        except OSError as err:
+            self.log.warning("Failed to open %s with O_DIRECT, corrupted "
+                             "offsets are page granular: %s", rel, err)
+            return -1
+
+    def _verify(self, rel, config, journal):
+        """Read a file block by block and return the failing blocks"""
+        cipher_block = config["block_size"]
+        plain_block = cipher_block - block_overhead(config)
+        errors = []
+        direct = None
+        try:
+            fd = os.open(os.path.join(self.path_decrypted, rel), os.O_RDONLY)
+        except OSError as err:
+            error = self._failure(rel, err)
+            self._record(journal, {"error": error})
+            self._record(journal, {"done": rel})
+            return [error]
+        try:
+            size = os.fstat(fd).st_size
+            for block, offset in enumerate(range(0, size, plain_block)):
+                self.limit.consume(plain_block)
+                try:
+                    os.pread(fd, plain_block, offset)
+                except OSError as err:
+                    if direct is None:
+                        direct = self._open_direct(rel)
+                    if direct >= 0:
+                        try:
+                            os.pread(direct, plain_block, offset)
+                            continue
+                        except OSError as direct_err:
+                            err = direct_err
+                    error = {"path": rel,
+                             "offset": offset,
+                             "encrypted_offset": header_size(config) +
+                             block * cipher_block,
+                             "error": err.strerror}
+                    self.log.error("Corrupted block in %s at offset %d",
+                                   rel, offset)
+                    self._record(journal, {"error": error})
+                    errors.append(error)
+        finally:
+            os.close(fd)
+            if direct is not None and direct >= 0:
+                os.close(direct)
+        self._record(journal, {"done": rel})
+        return errors
+
+    def run(self):
+        """Verify every file of the volume
+
+        Returns:
+        ========
+        list of dicts with "path" (relative to the mount point), "offset"
+        (plain offset), "encrypted_offset" and "error" of every corrupted
+        block, or None if the volume could not be scrubbed. Files and
+        directories which could not be read at all are reported with
+        offsets None. The checkpoint file is removed when the scrub
+        completes, so the next run verifies the whole volume again.
+        """
+        config = read_config(self.path_encrypted)
+        if config is None:
+            self.log.error("Failed to read encfs configuration of %s!",
+                           self.path_encrypted)
+            return None
+        if not block_overhead(config):
+            self.log.warning("Volume has no block MACs, only checking "
+                             "readability! %s", self.path_encrypted)
+        done, errors = self._load_checkpoint()
+        journal = None
+        if self.checkpoint is not None:
+            journal = open(str(self.checkpoint), "a")
+
+        def _onerror(path, err):
+            # not journaled, unreadable directories are scanned again anyway
+            errors.append(self._failure(
+                    os.path.relpath(path, self.path_decrypted), err))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                running = set()
+                for root, dirs, files in scantree(self.path_decrypted,
+                                                  self.workers, _onerror):
+                    for entry in files:
+                        rel = os.path.relpath(entry.path,
+                                              self.path_decrypted)
+                        if rel in done or not entry.is_file(
+                                follow_symlinks=False):
+                            continue
+                        if len(running) >= self.workers * 2:
+                            finished, running = wait(
+                                    running, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                errors.extend(future.result())
+                        running.add(pool.submit(self._verify, rel, config,
+                                                journal))
+                for future in running:
+                    errors.extend(future.result())
+        except OSError:
+            self.log.exception("Failed to scrub volume %s!",
+                               self.path_decrypted)
+            return None
+        finally:
+            if journal is not None:
+                journal.close()
+        if journal is not None:
+            os.remove(str(self.checkpoint))
+        if errors:
+            self.log.error("Scrub found %d corrupted blocks in %s!",
+                           len(errors), self.path_encrypted)
+        else:
+            self.log.info("Scrub found no corrupted blocks in %s.",
+                          self.path_encrypted)
+        return errors
@@ -0,0 +1,234 @@
+import builtins
+import errno
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .copytree import copy_file
+from .pyencfs import PyEncfs
+from .scan import scantree, _default_workers
+
+
+class ShardedStore():
+    """File store striped over several encfs volumes
+
+    Each encfs mount is served by a single daemon. Spreading files over
+    several volumes (e.g. one per disk) lets the daemons work in parallel.
+    Files are assigned to volumes (shards) by rendezvous hashing of their
+    path, so adding a shard only moves the files that now belong to it.
+    The shard of a file is identified by the absolute path of its
+    encrypted directory, which must therefore not change.
+    """
+
+    def __init__(self, shards, password, pyencfs=None, workers=None):
+        """Set up store for the given shards
+
+        Parameters:
+        ===========
+        shards : list
+            list of (path_encrypted, path_decrypted) tuples
+        password : str
+            Password to encrypt / decrypt files within all shards
+        pyencfs : PyEncfs
+            instance used to create / mount / unmount, defaults to PyEncfs()
+        workers : int
+            number of parallel operations
+        """
+        self.name = "ShardedStore"
+        self.log = logging.getLogger(__name__ + "." + self.name)
+        self.shards = [(os.path.abspath(str(e)), os.path.abspath(str(d)))
+                       for e, d in shards]
+        self.password = password
+        self.pyencfs = pyencfs or PyEncfs()
+        self.workers = workers or _default_workers()
+
+    def _all(self, func, shards):
+        """Run func(path_encrypted, path_decrypted) for shards in parallel"""
+        if not shards:
+            return True
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(lambda s: func(*s), shards))
+        return all(results)
+
+    def create(self):
+        """Create and mount all shards
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        return self._all(lambda e, d: self.pyencfs.create(e, d,
+                                                          self.password),
+                         self.shards)
+
+    def mount(self):
+        """Mount all shards which are not mounted yet
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        return self._all(lambda e, d: os.path.ismount(d) or
+                         self.pyencfs.mount(e, d, self.password),
+                         self.shards)
+
+    def umount(self):
+        """Unmount all shards
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        return self._all(lambda e, d: self.pyencfs.umount(d), self.shards)
+
+    @staticmethod
+    def _relpath(path):
+        """Normalize a store path, refusing paths outside the store"""
+        rel = os.path.normpath(str(path).lstrip("/"))
+        if rel == "." or rel == ".." or rel.startswith("../"):
+            raise ValueError("Invalid store path %s" % path)
+        return rel
+
+    def shard(self, path):
+        """Shard (path_encrypted, path_decrypted) a store path belongs to
+
+        Parameters:
+        ===========
+        path : str
+            path of the file within the store
+
+        Returns:
+        ========
+        tuple (path_encrypted, path_decrypted) of the shard
+        """
+        rel = self._relpath(path).encode()
+        return max(self.shards, key=lambda s: hashlib.sha1(
+            s[0].encode() + b"\0" + rel).digest())
+
+    def _path(self, path):
+        return os.path.join(self.shard(path)[1], self._relpath(path))
+
+    def _checkmounted(self, path_decrypted):
+        """Raise OSError unless the shard is mounted
+
+        Files written to an unmounted shard would end up unencrypted in
+        the mount point directory.
+        """
+        if not self.pyencfs._isencfsmount(path_decrypted):
+            raise OSError(errno.ENOTCONN, "Shard is not mounted",
+                          path_decrypted)
+
+    def open(self, path, mode="r", *args, **kwargs):
+        """Open a file of the store, see builtins.open
+
+        Parent directories are created when opening for writing. Raises
+        OSError when opening a file of an unmounted shard for writing.
+        """
+        full = self._path(path)
+        if any(c in mode for c in "wax+"):
+            self._checkmounted(self.shard(path)[1])
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+        return builtins.open(full, mode, *args, **kwargs)
+
+    def stat(self, path):
+        """os.stat of a file of the store"""
+        return os.stat(self._path(path))
+
+    def exists(self, path):
+        """True if the file exists in the store"""
+        return os.path.exists(self._path(path))
+
+    def remove(self, path):
+        """Remove a file from the store"""
+        os.remove(self._path(path))
+
+    def _files(self, path_decrypted):
+        for root, dirs, files in scantree(path_decrypted, self.workers):
+            for entry in files:
+                yield os.path.relpath(entry.path, path_decrypted)
+
+    def list(self):
+        """Sorted list of the paths of all files in the store
+
+        All shards are listed in parallel.
+        """
+        if not self.shards:
+            return []
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            listings = pool.map(lambda s: list(self._files(s[1])),
+                                self.shards)
+            return sorted(p for listing in listings for p in listing)
+
+    def add_shard(self, path_encrypted, path_decrypted, create=True):
+        """Add a shard to the store
+
+        Files are not moved to the new shard before rebalance() is called,
+        until then they are not found by open(), stat(), ...
+
+        Parameters:
+        ===========
+        path_encrypted : str
+            path to the encrypted directory of the new shard
+        path_decrypted : str
+            path to the decryption mount point of the new shard
+        create : bool
+            create the new volume, otherwise mount an existing one
+
+        Returns:
+        ========
+        True on success and False on failure
+        """
+        if create:
+            ok = self.pyencfs.create(path_encrypted, path_decrypted,
+                                     self.password)
+        else:
+            ok = self.pyencfs.mount(path_encrypted, path_decrypted,
+                                    self.password)
+        if ok:
+            self.shards.append((os.path.abspath(str(path_encrypted)),
+                                os.path.abspath(str(path_decrypted))))
+        else:
+            self.log.error("Failed to add shard %s!", path_encrypted)
+        return ok
+
+    def _move(self, rel, src, dst):
+        target = os.path.join(dst, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        copy_file(os.path.join(src, rel), target)
+        os.remove(os.path.join(src, rel))
+
+    def rebalance(self):
+        """Move all files to the shard they belong to
+
+        Files are moved in parallel with a bounded number of moves in
+        flight. With rendezvous hashing, only files assigned to newly added
+        shards are moved. Raises OSError if a shard is not mounted.
+
+        Returns:
+        ========
+        number of files moved
+        """
+        for path_encrypted, path_decrypted in self.shards:
+            self._checkmounted(path_decrypted)
+        moved = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            running = set()
+            for path_encrypted, path_decrypted in self.shards:
+                for rel in self._files(path_decrypted):
+                    target = self.shard(rel)[1]
+                    if target == path_decrypted:
+                        continue
+                    if len(running) >= self.workers * 2:
+                        done, running = wait(running,
+                                             return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                            moved += 1
+                    running.add(pool.submit(self._move, rel,
+                                            path_decrypted, target))
+            for future in running:
+                future.result()
+                moved += 1
+        self.log.info("Rebalanced store, moved %d files", moved)
+        return moved
@@ -0,0 +1,265 @@
+import bz2
+import logging
+import lzma
+import os
+import queue
+import tarfile
+import threading
+import zlib
+
+from .scan import scantree
+
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+QUEUE_CHUNKS = 16
+
+
+def _compressor(compression):
+    if compression is None:
+        return None
+    if compression == "gz":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "bz2":
+        return bz2.BZ2Compressor()
+    if compression == "xz":
+        return lzma.LZMACompressor()
+    raise ValueError("Unsupported compression %s" % compression)
+
+
+def _decompressor(compression):
+    if compression is None:
+        return None
+    if compression == "gz":
+        return zlib.decompressobj(31)
+    if compression == "bz2":
+        return bz2.BZ2Decompressor()
+    if compression == "xz":
+        return lzma.LZMADecompressor()
+    raise ValueError("Unsupported compression %s" % compression)
+
+
+class _PipeWriter():
+    """File like object compressing and writing data in a worker thread
+
+    Data written is passed through a bounded queue, so at most
+    QUEUE_CHUNKS chunks are buffered while the worker compresses and
+    writes to the target file object.
+    """
+
+    def __init__(self, fileobj, compression):
+        self.fileobj = fileobj
+        self.compressor = _compressor(compression)
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                if self.compressor is not None:
+                    data = self.compressor.compress(data)
+                self.fileobj.write(data)
+            if self.compressor is not None:
+                self.fileobj.write(self.compressor.flush())
+        except Exception as err:
+            self.error = err
+            # keep consuming so the producer does not block forever
+            while self.queue.get() is not None:
+                pass
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.buffer.append(bytes(data))
+        self.buffered += len(data)
+        if self.buffered >= CHUNK_SIZE:
+            self._flush()
+        return len(data)
+
+    def _flush(self):
+        if self.buffer:
+            self.queue.put(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        self._flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class _PipeReader():
+    """File like object reading and decompressing data in a worker thread
+
+    The worker reads ahead at most QUEUE_CHUNKS chunks.
+    """
+
+    def __init__(self, fileobj, compression):
+        self.fileobj = fileobj
+        self.decompressor = _decompressor(compression)
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.data = bytearray()
+        self.eof = False
+        self.error = None
+        self.stop = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stop:
+                data = self.fileobj.read(CHUNK_SIZE)
+                if not data:
+                    break
+                if self.decompressor is not None:
+                    data = self.decompressor.decompress(data)
+                if data:
+                    self.queue.put(data)
+        except Exception as err:
+            self.error = err
+        self.queue.put(None)
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.data) < size):
+            data = self.queue.get()
+            if data is None:
+                self.eof = True
+                if self.error is not None:
+                    raise self.error
+            else:
+                self.data += data
+        if size < 0:
+            size = len(self.data)
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        return data
+
+    def close(self):
+        self.stop = True
+        while not self.eof:
+            if self.queue.get() is None:
+                self.eof = True
+        self.thread.join()
+
+
+def _check_volume(volume, encrypted):
+    if encrypted:
+        if not os.path.isfile(os.path.join(str(volume), ".encfs6.xml")):
+            log.error("No encfs configuration found in %s!", volume)
+            return False
+    elif not os.path.ismount(str(volume)):
+        log.error("Given path is no mount point! %s", volume)
+        return False
+    return True
+
+
+def export_stream(volume, fileobj, encrypted=True, compression=None,
+                  workers=None):
+    """Write the content of a volume as tar stream to a file object
+
+    The tar stream is written directly to fileobj without temporary files.
+    Directories are read ahead by parallel scandir workers, files are
+    streamed in chunks and compression runs in a separate thread, so
+    memory use is bounded independent of the volume size.
+
+    Parameters:
+    ===========
+    volume : str
+        encrypted directory (encrypted=True) including its configuration,
+        or mount point of the volume (encrypted=False)
+    fileobj : file object
+        writable binary file object, e.g. a socket or pipe
+    encrypted : bool
+        export the encrypted files instead of the decrypted content
+    compression : str
+        None, "gz", "bz2" or "xz"
+    workers : int
+        number of parallel scandir workers
+
+    Returns:
+    ========
+    True on success and False on failure
+    """
+    if not _check_volume(volume, encrypted):
+        return False
+    top = str(volume)
+    pipe = _PipeWriter(fileobj, compression)
+    try:
+        with tarfile.open(fileobj=pipe, mode="w|",
+                          format=tarfile.PAX_FORMAT) as tar:
+            for root, dirs, files in scantree(top, workers):
+                rel = os.path.relpath(root, top)
+                if rel != ".":
+                    tar.add(root, arcname=rel, recursive=False)
+                for entry in files:
+                    tar.add(entry.path, recursive=False,
+                            arcname=os.path.normpath(
+                                os.path.join(rel, entry.name)))
+        pipe.close()
+    except Exception:
+        log.exception("Failed to export %s!", volume)
+        try:
+            pipe.close()
+        except Exception:
+            pass
+        return False
+    log.info("Exported %s", volume)
+    return True
+
+
+def import_stream(fileobj, volume, encrypted=True, compression=None):
+    """Extract a tar stream written by export_stream into a volume
+
+    Parameters:
+    ===========
+    fileobj : file object
+        readable binary file object
+    volume : str
+        encrypted directory to create (encrypted=True), must not exist or
+        must be empty, or mount point of the volume (encrypted=False)
+    encrypted : bool
+        the stream holds encrypted files including the configuration
+    compression : str
+        None, "gz", "bz2" or "xz"
+
+    Returns:
+    ========
+    True on success and False on failure
+    """
+    if encrypted:
+        if os.path.exists(str(volume)) and os.listdir(str(volume)):
+            log.error("Given path is not empty and cannot be used! %s",
+                      volume)
+            return False
+        os.makedirs(str(volume), exist_ok=True)
+    elif not _check_volume(volume, encrypted):
+        return False
+    pipe = _PipeReader(fileobj, compression)
+    try:
+        with tarfile.open(fileobj=pipe, mode="r|") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(str(volume), filter="data")
+            else:
+                for member in tar:
+                    for name in (member.name, member.linkname):
+                        if name.startswith("/") or ".." in name.split("/"):
+                            raise tarfile.TarError("Refusing unsafe member "
+                                                   "%s" % member.name)
+                    tar.extract(member, str(volume))
+    except Exception:
+        log.exception("Failed to import into %s!", volume)
+        return False
+    finally:
+        pipe.close()
+    log.info("Imported into %s", volume)
+    return True
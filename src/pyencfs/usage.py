@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+
+from .config import read_config, plain_size, header_size, CONFIG_FILE
+from .scan import scantree
+
+
+log = logging.getLogger(__name__)
+
+_FIELDS = ("files", "encrypted_bytes", "disk_bytes", "plain_bytes",
+           "header_bytes", "name_bytes")
+
+
+def _directory_usage(root, files, config, top):
+    """Usage totals of the files directly within one directory"""
+    totals = dict.fromkeys(_FIELDS, 0)
+    for entry in files:
+        if root == top and entry.name == CONFIG_FILE:
+            continue
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            log.warning("File vanished during scan %s", entry.path)
+            continue
+        totals["files"] += 1
+        totals["encrypted_bytes"] += st.st_size
+        totals["disk_bytes"] += st.st_blocks * 512
+        totals["name_bytes"] += len(os.fsencode(entry.name))
+        if entry.is_file(follow_symlinks=False):
+            plain = plain_size(config, st.st_size)
+            totals["plain_bytes"] += plain
+            if st.st_size:
+                totals["header_bytes"] += header_size(config)
+        else:
+            # symlinks hold their encrypted target, no file header / MACs
+            totals["plain_bytes"] += st.st_size
+    return totals
+
+
+def usage(path_encrypted, workers=None, cache=None):
+    """Space usage and encfs overhead of an encrypted directory
+
+    Walks the encrypted directory in parallel and derives the plain file
+    sizes from the encrypted sizes and the volume configuration, so the
+    volume does not need to be mounted.
+
+    With a cache file, the totals of every directory are stored together
+    with the directory modification time and reused while it is unchanged.
+    The modification time of a directory only changes when files are
+    added, removed or renamed, so files changed in place are not updated
+    from the cache.
+
+    Parameters:
+    ===========
+    path_encrypted : str
+        path to the encrypted directory holding the encfs file system
+    workers : int
+        number of parallel scandir workers
+    cache : str
+        path to a JSON cache file, None disables caching
+
+    Returns:
+    ========
+    dict with "files", "dirs", "encrypted_bytes" (apparent size),
+    "disk_bytes" (allocated size), "plain_bytes", "header_bytes",
+    "mac_bytes", "overhead_bytes" (encrypted minus plain bytes) and
+    "name_bytes" (length of all encrypted file names), or None if the
+    configuration could not be read
+    """
+    top = str(path_encrypted)
+    config = read_config(top)
+    if config is None:
+        log.error("Failed to read encfs configuration of %s!", top)
+        return None
+    cached = {}
+    if cache is not None and os.path.exists(str(cache)):
+        try:
+            with open(str(cache)) as f:
+                cached = json.load(f)
+        except ValueError:
+            log.warning("Ignoring invalid usage cache %s", cache)
+    new_cache = {}
+    result = dict.fromkeys(_FIELDS, 0)
+    result["dirs"] = 0
+    for root, dirs, files in scantree(top, workers):
+        result["dirs"] += len(dirs)
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+        entry = cached.get(root)
+        if entry is not None and entry["mtime_ns"] == mtime:
+            totals = entry["totals"]
+        else:
+            totals = _directory_usage(root, files, config, top)
+        new_cache[root] = {"mtime_ns": mtime, "totals": totals}
+        for field in _FIELDS:
+            result[field] += totals[field]
+    result["overhead_bytes"] = result["encrypted_bytes"] - \
+        result["plain_bytes"]
+    result["mac_bytes"] = result["overhead_bytes"] - result["header_bytes"]
+    if cache is not None:
+        tmp = str(cache) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(new_cache, f)
+        os.replace(tmp, str(cache))
+    return result
@@ -0,0 +1,66 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.blockers import find_blockers
+from src.pyencfs.pyencfs import PyEncfs
+import os
+import logging
+import mock
+
+
+class TestFindBlockers(LoggingCount):
+
+    def test_open_file(self, tmpdir):
+        with open(str(tmpdir + "/foo"), "w+"):
+            blockers = find_blockers(tmpdir)
+        assert [b["pid"] for b in blockers] == [os.getpid()]
+        assert blockers[0]["reasons"] == ["fd"]
+
+    def test_cwd(self, tmpdir):
+        cwd = os.getcwd()
+        os.chdir(str(tmpdir))
+        try:
+            blockers = find_blockers(tmpdir)
+        finally:
+            os.chdir(cwd)
+        assert "cwd" in blockers[0]["reasons"]
+
+    def test_unused(self, tmpdir):
+        assert find_blockers(tmpdir) == []
+
+
+class TestPyEncfsLeases(LoggingCount):
+
+    def test_lease(self, tmpdir):
+        e = PyEncfs()
+        with mock.patch("os.path.ismount", return_value=True):
+            assert e.acquire_lease(tmpdir)
+            assert e.acquire_lease(tmpdir)
+        e.release_lease(tmpdir)
+        assert e._leases == {str(tmpdir): 1}
+        e.release_lease(tmpdir)
+        assert e._leases == {}
+
+    def test_lease_not_mounted(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert not e.acquire_lease(tmpdir)
+        assert "Given path is no mount point" in caplog.text
+
+    def test_drain_timeout(self, tmpdir, caplog):
+        e = PyEncfs()
+        with mock.patch("os.path.ismount", return_value=True):
+            assert e.acquire_lease(tmpdir)
+        assert not e.drain_and_umount(tmpdir, timeout=0.1, interval=0.01)
+        assert "Timeout draining" in caplog.text
+        assert e._draining == set()
+
+    def test_drain_and_umount(self, tmpdir, caplog):
+        caplog.set_level(logging.DEBUG)
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert e.acquire_lease(tmpdir + "/d")
+        f = open(str(tmpdir + "/d/foo"), "w+")
+        e.release_lease(tmpdir + "/d")
+        assert not e.drain_and_umount(tmpdir + "/d", timeout=0.2)
+        assert "blocked by pids [%d]" % os.getpid() in caplog.text
+        f.close()
+        assert e.drain_and_umount(tmpdir + "/d", timeout=5)
+        assert not os.path.ismount(str(tmpdir + "/d"))
@@ -0,0 +1,137 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.cli import load_plan, apply_plan, main, PlanError
+import json
+import threading
+import time
+import pytest
+
+
+def plan_file(tmpdir, steps):
+    with open(str(tmpdir + "/plan.json"), "w+") as f:
+        json.dump({"steps": steps}, f)
+    return tmpdir + "/plan.json"
+
+
+class FakeEncfs():
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def mount(self, path_encrypted, path_decrypted, password):
+        time.sleep(0.05)
+        with self.lock:
+            self.calls.append(("mount", path_decrypted, password))
+        return path_encrypted != "bad"
+
+    def umount(self, path):
+        with self.lock:
+            self.calls.append(("umount", path))
+        return True
+
+
+class TestLoadPlan(LoggingCount):
+
+    def test_valid_plan(self, tmpdir):
+        plan = load_plan(plan_file(tmpdir, [
+            {"id": "a", "op": "mount", "args": {}},
+            {"id": "b", "op": "umount", "args": {}, "after": ["a"]}]))
+        assert len(plan["steps"]) == 2
+
+    @pytest.mark.parametrize("steps", [
+        [{"id": "a", "op": "format"}],
+        [{"id": "a", "op": "mount"}, {"id": "a", "op": "mount"}],
+        [{"id": "a", "op": "mount", "after": ["x"]}],
+        [{"id": "a", "op": "mount", "after": ["b"]},
+         {"id": "b", "op": "mount", "after": ["a"]}],
+        ["a"],
+        [{"id": 1, "op": "mount"}],
+        [{"id": ["a"], "op": "mount"}],
+        [{"id": "a", "op": "mount", "after": "b"}],
+        [{"id": "a", "op": "mount", "after": [["b"]]}],
+        [{"id": "a", "op": "mount", "args": ["x"]}],
+    ])
+    def test_invalid_plan(self, tmpdir, steps):
+        with pytest.raises(PlanError):
+            load_plan(plan_file(tmpdir, steps))
+
+    def test_plan_is_no_object(self, tmpdir):
+        with open(str(tmpdir + "/plan.json"), "w+") as f:
+            json.dump([{"id": "a", "op": "mount"}], f)
+        with pytest.raises(PlanError):
+            load_plan(tmpdir + "/plan.json")
+
+
+class TestApplyPlan(LoggingCount):
+
+    def test_dependencies_and_concurrency(self, tmpdir, monkeypatch):
+        monkeypatch.setenv("PW", "PASSWORD")
+        e = FakeEncfs()
+        steps = [{"id": "m%d" % i, "op": "mount",
+                  "args": {"path_encrypted": "e%d" % i,
+                           "path_decrypted": "d%d" % i,
+                           "password_env": "PW"}} for i in range(4)]
+        steps.append({"id": "u", "op": "umount", "args": {"path": "d0"},
+                      "after": ["m0", "m1", "m2", "m3"]})
+        start = time.monotonic()
+        reports = apply_plan({"steps": steps}, e, workers=4)
+        assert time.monotonic() - start < 0.15
+        assert [r["status"] for r in reports] == ["ok"] * 5
+        assert e.calls[-1] == ("umount", "d0")
+        assert ("mount", "d0", "PASSWORD") in e.calls
+
+    def test_failed_dependency_skips(self, tmpdir):
+        e = FakeEncfs()
+        steps = [{"id": "m", "op": "mount",
+                  "args": {"path_encrypted": "bad", "path_decrypted": "d",
+                           "password": "x"}},
+                 {"id": "u", "op": "umount", "args": {"path": "d"},
+                  "after": ["m"]},
+                 {"id": "v", "op": "umount", "args": {"path": "d"},
+                  "after": ["u"]},
+                 {"id": "w", "op": "umount", "args": {"wrong": "d"}}]
+        reports = apply_plan({"steps": steps}, e)
+        assert [r["status"] for r in reports] == ["failed", "skipped",
+                                                  "skipped", "failed"]
+        assert reports[3]["error"] is not None
+        assert e.calls == [("mount", "d", "x")]
+
+    def test_cycle(self):
+        steps = [{"id": "a", "op": "umount", "after": ["b"]},
+                 {"id": "b", "op": "umount", "after": ["a"]}]
+        with pytest.raises(PlanError):
+            apply_plan({"steps": steps}, FakeEncfs())
+
+
+class TestMain(LoggingCount):
+
+    def test_is_encfs_json(self, tmpdir, capsys):
+        assert main(["is-encfs", str(tmpdir)]) == 1
+        output = json.loads(capsys.readouterr().out)
+        assert output == {"command": "is-encfs", "ok": False}
+
+    def test_apply_invalid_plan(self, tmpdir, capsys):
+        assert main(["apply", str(tmpdir + "/missing.json")]) == 1
+        output = json.loads(capsys.readouterr().out)
+        assert not output["ok"]
+        assert "error" in output
+
+    def test_apply(self, tmpdir, capsys):
+        plan = plan_file(tmpdir, [{"id": "a", "op": "is_encfs",
+                                   "args": {"path_encrypted": str(tmpdir)}}])
+        assert main(["apply", str(plan)]) == 1
+        output = json.loads(capsys.readouterr().out)
+        assert output["steps"][0]["status"] == "failed"
+        assert "seconds" in output["steps"][0]
+
+    @pytest.mark.parametrize("workers", ["0", "-1", "x"])
+    def test_apply_invalid_workers(self, tmpdir, workers, capsys):
+        plan = plan_file(tmpdir, [])
+        with pytest.raises(SystemExit) as exc:
+            main(["apply", str(plan), "--workers", workers])
+        assert exc.value.code == 2
+        assert "positive integer" in capsys.readouterr().err
+
+    def test_options_with_equals_sign(self, tmpdir, capsys):
+        assert main(["--options=--paranoia", "is-encfs", str(tmpdir)]) == 1
+        assert json.loads(capsys.readouterr().out)["ok"] is False
@@ -0,0 +1,80 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.copytree import copy_tree, compare_trees, exchange_paths
+from src.pyencfs.copytree import clone_file
+import os
+import mock
+import pytest
+
+
+def write(path, content):
+    with open(str(path), "w+") as f:
+        f.write(content)
+
+
+class TestCopyTree(LoggingCount):
+
+    def test_copy_tree(self, tmpdir):
+        os.makedirs(str(tmpdir + "/s/a/b"))
+        write(tmpdir + "/s/foo", "foo")
+        write(tmpdir + "/s/a/b/bar", "bar")
+        os.symlink("foo", str(tmpdir + "/s/link"))
+        copied = []
+        assert copy_tree(tmpdir + "/s", tmpdir + "/d", 2,
+                         on_done=copied.append) == 3
+        assert sorted(copied) == ["a/b/bar", "foo", "link"]
+        assert os.readlink(str(tmpdir + "/d/link")) == "foo"
+        assert compare_trees(tmpdir + "/s", tmpdir + "/d") == []
+
+    def test_copy_tree_skips_done(self, tmpdir):
+        os.makedirs(str(tmpdir + "/s"))
+        write(tmpdir + "/s/foo", "foo")
+        write(tmpdir + "/s/bar", "bar")
+        assert copy_tree(tmpdir + "/s", tmpdir + "/d", 2, {"foo"}) == 1
+        assert compare_trees(tmpdir + "/s", tmpdir + "/d") == ["foo"]
+
+    def test_copy_tree_unreadable_directory(self, tmpdir):
+        os.makedirs(str(tmpdir + "/s/a"))
+        write(tmpdir + "/s/a/bar", "bar")
+        scandir = os.scandir
+
+        def _scandir(path):
+            if os.path.basename(path) == "a":
+                raise PermissionError(13, "Permission denied", path)
+            return scandir(path)
+        with mock.patch("os.scandir", _scandir):
+            with pytest.raises(PermissionError):
+                copy_tree(tmpdir + "/s", tmpdir + "/d")
+            with pytest.raises(PermissionError):
+                compare_trees(tmpdir + "/s", tmpdir + "/s")
+
+    def test_compare_trees_content(self, tmpdir):
+        os.makedirs(str(tmpdir + "/s"))
+        os.makedirs(str(tmpdir + "/d"))
+        write(tmpdir + "/s/foo", "foo")
+        write(tmpdir + "/d/foo", "bar")
+        assert compare_trees(tmpdir + "/s", tmpdir + "/d") == ["foo"]
+
+    def test_exchange_paths(self, tmpdir):
+        os.makedirs(str(tmpdir + "/a"))
+        os.makedirs(str(tmpdir + "/b"))
+        write(tmpdir + "/a/foo", "foo")
+        exchange_paths(tmpdir + "/a", tmpdir + "/b")
+        assert os.listdir(str(tmpdir + "/a")) == []
+        assert os.listdir(str(tmpdir + "/b")) == ["foo"]
+
+
+class TestCloneFile(LoggingCount):
+
+    def test_clone_file(self, tmpdir):
+        write(tmpdir + "/foo", "foo" * 100000)
+        clone_file(str(tmpdir + "/foo"), str(tmpdir + "/bar"))
+        with open(str(tmpdir + "/bar")) as f:
+            assert f.read() == "foo" * 100000
+
+    def test_clone_file_fallback(self, tmpdir):
+        write(tmpdir + "/foo", "foo" * 100000)
+        with mock.patch("fcntl.ioctl", side_effect=OSError(95, "")), \
+                mock.patch("os.copy_file_range", side_effect=OSError(18, "")):
+            clone_file(str(tmpdir + "/foo"), str(tmpdir + "/bar"))
+        with open(str(tmpdir + "/bar")) as f:
+            assert f.read() == "foo" * 100000
@@ -0,0 +1,167 @@
+from tests.utils.logging import LoggingCount
+from tests.utils.config import write_config
+from src.pyencfs.daemon import PyEncfsDaemon, PyEncfsClient, _default_socket
+import os
+import socket
+import threading
+import time
+import mock
+import pytest
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    d = PyEncfsDaemon(tmpdir + "/pyencfs.sock")
+    t = threading.Thread(target=d.serve_forever)
+    t.start()
+    # the socket file exists after bind, but connects fail until listen
+    for i in range(100):
+        if d.server is not None:
+            break
+        time.sleep(0.01)
+    yield d
+    d.shutdown()
+    t.join(5)
+
+
+class TestPyEncfsDaemon(LoggingCount):
+
+    def test_ping(self, tmpdir, daemon):
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            assert c.ping()
+            assert c.ping()
+        assert os.stat(str(tmpdir + "/pyencfs.sock")).st_mode & 0o077 == 0
+
+    def test_status_with_config(self, tmpdir, daemon):
+        write_config(tmpdir + "/e")
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            s = c.status(tmpdir + "/d", tmpdir + "/e")
+        assert not s["mounted"]
+        assert s["leases"] == 0
+        assert s["config"]["block_size"] == 1024
+        assert daemon.config(tmpdir + "/e") is daemon.config(tmpdir + "/e")
+
+    def test_unknown_operation(self, tmpdir, daemon):
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            with pytest.raises(RuntimeError):
+                c._call("format")
+            assert c.ping()
+
+    def test_leases_released_on_disconnect(self, tmpdir, daemon):
+        with mock.patch("os.path.ismount", return_value=True):
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+                assert c.lease(tmpdir + "/d")
+                assert c.status(tmpdir + "/d")["leases"] == 1
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+                for i in range(100):
+                    if c.status(tmpdir + "/d")["leases"] == 0:
+                        break
+                    time.sleep(0.01)
+                assert c.status(tmpdir + "/d")["leases"] == 0
+
+    def test_mount_umount(self, tmpdir, daemon):
+        assert daemon.pyencfs.create(tmpdir + "/e", tmpdir + "/d",
+                                     "PASSWORD")
+        assert daemon.pyencfs.umount(tmpdir + "/d")
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            assert c.check_password(tmpdir + "/e", "PASSWORD")
+            assert c.mount(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+            assert c.mount(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+            assert c.status(tmpdir + "/d")["mounted"]
+            assert c.umount(tmpdir + "/d")
+
+    def test_release_requires_own_lease(self, tmpdir, daemon):
+        with mock.patch("os.path.ismount", return_value=True):
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as a, \
+                    PyEncfsClient(tmpdir + "/pyencfs.sock") as b:
+                assert a.lease(tmpdir + "/d")
+                with pytest.raises(RuntimeError):
+                    b.release(tmpdir + "/d")
+                assert b.status(tmpdir + "/d")["leases"] == 1
+                assert a.release(tmpdir + "/d") is None
+                with pytest.raises(RuntimeError):
+                    a.release(tmpdir + "/d")
+                assert a.status(tmpdir + "/d")["leases"] == 0
+
+    def test_lease_invalid_path(self, tmpdir, daemon):
+        with mock.patch("os.path.ismount", return_value=True):
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+                for args in [{}, {"path": 1}, {"path": ["/"]}]:
+                    with pytest.raises(RuntimeError):
+                        c._call("lease", **args)
+                assert daemon.pyencfs._leases == {}
+
+    def test_refuses_running_daemon(self, tmpdir, daemon):
+        with pytest.raises(OSError):
+            PyEncfsDaemon(tmpdir + "/pyencfs.sock").serve_forever()
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            assert c.ping()
+
+    def test_replaces_stale_socket(self, tmpdir):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(str(tmpdir + "/pyencfs.sock"))
+        stale.close()
+        d = PyEncfsDaemon(tmpdir + "/pyencfs.sock")
+        t = threading.Thread(target=d.serve_forever)
+        t.start()
+        for i in range(100):
+            if d.server is not None:
+                break
+            time.sleep(0.01)
+        with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+            assert c.ping()
+        d.shutdown()
+        t.join(5)
+
+    def test_refuses_non_socket(self, tmpdir):
+        open(str(tmpdir + "/pyencfs.sock"), "w+")
+        with pytest.raises(OSError):
+            PyEncfsDaemon(tmpdir + "/pyencfs.sock").serve_forever()
+        assert os.path.isfile(str(tmpdir + "/pyencfs.sock"))
+
+    def test_umount_refused_with_leases(self, tmpdir, daemon):
+        with mock.patch("os.path.ismount", return_value=True), \
+                mock.patch.object(daemon.pyencfs, "umount",
+                                  return_value=True) as umount:
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+                assert c.lease(tmpdir + "/d")
+                assert c.umount(tmpdir + "/d") is False
+                assert not umount.called
+                assert c.release(tmpdir + "/d") is None
+                assert c.umount(tmpdir + "/d") is True
+            assert daemon.pyencfs._draining == set()
+
+    def test_client_sends_absolute_paths(self, tmpdir, daemon):
+        with mock.patch("os.path.ismount", return_value=True):
+            with PyEncfsClient(tmpdir + "/pyencfs.sock") as c:
+                with tmpdir.as_cwd():
+                    assert c.lease("d")
+                assert c.status(tmpdir + "/d")["leases"] == 1
+
+    def test_client_refuses_foreign_socket(self, tmpdir):
+        foreign = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        foreign.bind(str(tmpdir + "/pyencfs.sock"))
+        foreign.listen(1)
+        try:
+            with mock.patch("os.getuid", return_value=12345), \
+                    mock.patch("os.lstat") as lstat:
+                lstat.return_value.st_mode = os.stat(
+                        str(tmpdir + "/pyencfs.sock")).st_mode
+                lstat.return_value.st_uid = 23456
+                with pytest.raises(PermissionError):
+                    PyEncfsClient(tmpdir + "/pyencfs.sock")
+        finally:
+            foreign.close()
+
+    def test_refuses_unsafe_socket_directory(self, tmpdir):
+        os.makedirs(str(tmpdir + "/shared"))
+        os.chmod(str(tmpdir + "/shared"), 0o777)
+        with pytest.raises(PermissionError):
+            PyEncfsDaemon(tmpdir + "/shared/pyencfs.sock").serve_forever()
+        assert os.listdir(str(tmpdir + "/shared")) == []
+
+    def test_default_socket(self):
+        with mock.patch.dict("os.environ", {"XDG_RUNTIME_DIR": ""}):
+            path = _default_socket()
+        assert os.path.basename(os.path.dirname(path)) == \
+            "pyencfs-%d" % os.getuid()
@@ -0,0 +1,45 @@
+from tests.utils.logging import LoggingCount
+from tests.utils.config import write_config
+from src.pyencfs.discover import discover_volumes, encfs_mounts
+from src.pyencfs.discover import _encfs_arguments
+from src.pyencfs.pyencfs import PyEncfs
+import os
+
+
+class TestDiscoverVolumes(LoggingCount):
+
+    def test_discover_volumes(self, tmpdir):
+        write_config(tmpdir + "/a/e")
+        write_config(tmpdir + "/b/c/e")
+        write_config(tmpdir + "/b/c/e/nested")
+        os.makedirs(str(tmpdir + "/d"))
+        volumes = sorted(discover_volumes(tmpdir, 4),
+                         key=lambda v: v["path_encrypted"])
+        assert [v["path_encrypted"] for v in volumes] == [
+                str(tmpdir + "/a/e"), str(tmpdir + "/b/c/e")]
+        assert volumes[0]["config"]["block_size"] == 1024
+        assert not volumes[0]["mounted"]
+        assert volumes[0]["path_decrypted"] is None
+
+    def test_invalid_config(self, tmpdir, caplog):
+        os.makedirs(str(tmpdir + "/e"))
+        open(str(tmpdir + "/e/.encfs6.xml"), "w+")
+        assert list(discover_volumes(tmpdir)) == []
+        assert "Unable to parse encfs configuration" in caplog.text
+
+    def test_encfs_arguments(self):
+        assert _encfs_arguments(["encfs", "--standard", "--stdinpass",
+                                 "/e", "/d"]) == ("/e", "/d")
+        assert _encfs_arguments(["encfs", "-o", "allow_other",
+                                 "/e", "/d", "--", "-f"]) == ("/e", "/d")
+        assert _encfs_arguments(["encfs", "--version"]) is None
+
+    def test_discover_mounted_volume(self, tmpdir):
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert encfs_mounts()[str(tmpdir + "/e")] == str(tmpdir + "/d")
+        volumes = list(discover_volumes(tmpdir))
+        assert len(volumes) == 1
+        assert volumes[0]["mounted"]
+        assert volumes[0]["path_decrypted"] == str(tmpdir + "/d")
+        assert e.umount(tmpdir + "/d")
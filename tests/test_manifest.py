@@ -0,0 +1,123 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.manifest import Manifest
+from src.pyencfs.scan import scantree
+import os
+import mock
+
+
+def write(path, content):
+    with open(str(path), "w+") as f:
+        f.write(content)
+
+
+class TestScanTree(LoggingCount):
+
+    def test_scantree_finds_all_files(self, tmpdir):
+        os.makedirs(str(tmpdir + "/a/b/c"))
+        write(tmpdir + "/foo", "foo")
+        write(tmpdir + "/a/b/c/bar", "bar")
+        files = set()
+        for root, dirs, entries in scantree(tmpdir, 4):
+            files.update(e.name for e in entries)
+        assert files == {"foo", "bar"}
+
+    def test_scantree_prune(self, tmpdir):
+        os.makedirs(str(tmpdir + "/a/b"))
+        write(tmpdir + "/a/b/bar", "bar")
+        files = set()
+        for root, dirs, entries in scantree(tmpdir, 4):
+            dirs[:] = [d for d in dirs if d.name != "a"]
+            files.update(e.name for e in entries)
+        assert files == set()
+
+    def test_scantree_missing_root(self, tmpdir, caplog):
+        assert list(scantree(tmpdir + "/missing")) == [
+                (str(tmpdir + "/missing"), [], [])]
+        self.assert_logging(1, "WARNING", caplog)
+
+    def test_scantree_onerror(self, tmpdir):
+        errors = []
+        list(scantree(tmpdir + "/missing",
+                      onerror=lambda p, e: errors.append(p)))
+        assert errors == [str(tmpdir + "/missing")]
+
+
+def _failing_scandir(name):
+    scandir = os.scandir
+
+    def _scandir(path):
+        if os.path.basename(path) == name:
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+    return _scandir
+
+
+class TestManifest(LoggingCount):
+
+    def test_first_update_adds_all(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e/a"))
+        write(tmpdir + "/e/foo", "foo")
+        write(tmpdir + "/e/a/bar", "bar")
+        with Manifest(tmpdir + "/e") as m:
+            delta = m.update()
+        assert delta == {"added": ["a/bar", "foo"],
+                         "changed": [], "removed": []}
+        assert os.path.isfile(str(tmpdir + "/e.manifest"))
+
+    def test_delta(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e"))
+        write(tmpdir + "/e/foo", "foo")
+        write(tmpdir + "/e/bar", "bar")
+        with Manifest(tmpdir + "/e") as m:
+            m.update()
+            assert m.update() == {"added": [], "changed": [], "removed": []}
+            write(tmpdir + "/e/foo", "foofoo")
+            os.remove(str(tmpdir + "/e/bar"))
+            write(tmpdir + "/e/baz", "baz")
+            assert m.update() == {"added": ["baz"], "changed": ["foo"],
+                                  "removed": ["bar"]}
+
+    def test_dry_run(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e"))
+        write(tmpdir + "/e/foo", "foo")
+        with Manifest(tmpdir + "/e", tmpdir + "/index.db") as m:
+            assert m.update(commit=False)["added"] == ["foo"]
+            assert m.update()["added"] == ["foo"]
+
+    def test_hashing(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e"))
+        write(tmpdir + "/e/foo", "foo")
+        with Manifest(tmpdir + "/e", hashing=True) as m:
+            m.update()
+            assert m.hash("foo") == ("2c26b46b68ffc68ff99b453c1d304134"
+                                     "13422d706483bfa0f98a5e886266e7ae")
+            assert m.hash("bar") is None
+
+    def test_unreadable_directory_not_removed(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e/a"))
+        write(tmpdir + "/e/foo", "foo")
+        write(tmpdir + "/e/a/bar", "bar")
+        with Manifest(tmpdir + "/e") as m:
+            m.update()
+            os.remove(str(tmpdir + "/e/foo"))
+            with mock.patch("os.scandir", _failing_scandir("a")):
+                assert m.update()["removed"] == ["foo"]
+            assert m.update() == {"added": [], "changed": [], "removed": []}
+
+    def test_hashing_file_vanished(self, tmpdir):
+        os.makedirs(str(tmpdir + "/e"))
+        write(tmpdir + "/e/foo", "foo")
+        write(tmpdir + "/e/bar", "bar")
+        with Manifest(tmpdir + "/e", hashing=True) as m:
+            hash_ = m._hash
+
+            def vanishing_hash(path):
+                if path == "foo":
+                    os.remove(str(tmpdir + "/e/foo"))
+                return hash_(path)
+
+            with mock.patch.object(m, "_hash", side_effect=vanishing_hash):
+                assert m.update() == {"added": ["bar"], "changed": [],
+                                      "removed": []}
+            assert m.hash("foo") is None
+            assert m.hash("bar") is not None
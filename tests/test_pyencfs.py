@@ -1,8 +1,10 @@
 from tests.utils.logging import LoggingCount
+from tests.utils.config import write_config
 from src.pyencfs.pyencfs import PyEncfs
 import os
 import mock
 import logging
+import threading
 
 
 class TestPyEncfsIsPyEncfs(LoggingCount):
@@ -178,6 +180,15 @@ class TestPyEncfsMount(LoggingCount):
             assert not e.mount(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
         assert "Failed to detect valid mount point at" in caplog.text
 
+    def test_mount_uses_absolute_paths(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/e")
+        run = mock.MagicMock(return_value=True)
+        with tmpdir.as_cwd(), mock.patch("subprocess.run", run):
+            assert not e.mount("e", "d", "PASSWORD")
+        assert run.call_args[0][0].endswith(
+                " --stdinpass '%s/e' '%s/d'" % (tmpdir, tmpdir))
+
     def test_decryption_directory_is_file(self, tmpdir, caplog):
         e = PyEncfs()
         assert e._createpath(tmpdir + "/e")
@@ -274,3 +285,212 @@ class TestPyEncfsCreatePath(LoggingCount):
         self.assert_logging(1, "ERROR", caplog)
         assert "Path is a mount point" in caplog.text
         assert e.umount(tmpdir + "/d")
+
+
+class TestPyEncfsReverse(LoggingCount):
+
+    def test_create_reverse(self, tmpdir, caplog):
+        caplog.set_level(logging.DEBUG)
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/p")
+        with open(str(tmpdir + "/p/foo.txt"), "w+") as f:
+            f.write("foo")
+        assert e.create_reverse(tmpdir + "/p", tmpdir + "/v", "PASSWORD")
+        assert os.path.isfile(str(tmpdir + "/p/.encfs6.xml"))
+        assert e._isencfsmount(tmpdir + "/v")
+        assert len(os.listdir(str(tmpdir + "/v"))) == 1
+        assert "foo.txt" not in os.listdir(str(tmpdir + "/v"))
+        assert e.umount(tmpdir + "/v")
+
+    def test_create_reverse_existing_config(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/p")
+        open(str(tmpdir + "/p/.encfs6.xml"), "w+")
+        assert not e.create_reverse(tmpdir + "/p", tmpdir + "/v", "PASSWORD")
+        assert "Reverse encfs configuration exists already" in caplog.text
+
+    def test_mount_reverse_plain_is_file(self, tmpdir, caplog):
+        e = PyEncfs()
+        open(str(tmpdir + "/p"), "w+")
+        assert not e.mount_reverse(tmpdir + "/p", tmpdir + "/v", "PASSWORD")
+        assert "Failed to mount reverse encfs file system" in caplog.text
+
+    def test_backup_reverse(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/p")
+        with open(str(tmpdir + "/p/foo.txt"), "w+") as f:
+            f.write("foo")
+        assert e.backup_reverse(tmpdir + "/p", tmpdir + "/v",
+                                tmpdir + "/b", "PASSWORD")
+        assert not os.path.ismount(str(tmpdir + "/v"))
+        assert e.mount(tmpdir + "/b", tmpdir + "/r", "PASSWORD")
+        with open(str(tmpdir + "/r/foo.txt")) as f:
+            assert f.read() == "foo"
+        assert e.umount(tmpdir + "/r")
+
+    def test_backup_reverse_removes_deleted_files(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/p")
+        with open(str(tmpdir + "/p/foo.txt"), "w+") as f:
+            f.write("foo")
+        assert e.backup_reverse(tmpdir + "/p", tmpdir + "/v",
+                                tmpdir + "/b", "PASSWORD")
+        backup = set(os.listdir(str(tmpdir + "/b")))
+        os.remove(str(tmpdir + "/p/foo.txt"))
+        assert e.backup_reverse(tmpdir + "/p", tmpdir + "/v",
+                                tmpdir + "/b", "PASSWORD")
+        assert len(backup) == 2
+        assert os.listdir(str(tmpdir + "/b")) == [".encfs6.xml"]
+
+
+class TestPyEncfsRekey(LoggingCount):
+
+    def test_rekey_volume(self, tmpdir, caplog):
+        caplog.set_level(logging.DEBUG)
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        with open(str(tmpdir + "/d/foo.txt"), "w+") as f:
+            f.write("foo")
+        assert e.umount(tmpdir + "/d")
+        assert e.rekey_volume(tmpdir + "/e", "PASSWORD",
+                              tmpdir + "/n", "PASSWD")
+        assert e.check_password(tmpdir + "/e", "PASSWD")
+        assert e.check_password(tmpdir + "/n", "PASSWORD")
+        assert not os.path.exists(str(tmpdir + "/n.rekey-journal"))
+        assert e.mount(tmpdir + "/e", tmpdir + "/d", "PASSWD")
+        with open(str(tmpdir + "/d/foo.txt")) as f:
+            assert f.read() == "foo"
+        assert e.umount(tmpdir + "/d")
+
+    def test_rekey_wrong_password(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert e.umount(tmpdir + "/d")
+        assert not e.rekey_volume(tmpdir + "/e", "PASSWORD1",
+                                  tmpdir + "/n", "PASSWD")
+        assert e.check_password(tmpdir + "/e", "PASSWORD")
+
+    def test_rekey_new_volume_not_empty(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e._createpath(tmpdir + "/n")
+        open(str(tmpdir + "/n/foo.txt"), "w+")
+        assert not e.rekey_volume(tmpdir + "/e", "PASSWORD",
+                                  tmpdir + "/n", "PASSWD")
+        assert "Failed to create new volume for re-key" in caplog.text
+
+    def test_rekey_mounted_volume(self, tmpdir, caplog):
+        e = PyEncfs()
+        mounts = {str(tmpdir + "/e"): str(tmpdir + "/d")}
+        with mock.patch("src.pyencfs.pyencfs.encfs_mounts",
+                        return_value=mounts):
+            assert not e.rekey_volume(tmpdir + "/e", "PASSWORD",
+                                      tmpdir + "/n", "PASSWD")
+        assert not os.path.exists(str(tmpdir + "/n"))
+        assert "is mounted at" in caplog.text
+
+
+class TestPyEncfsClone(LoggingCount):
+
+    def test_clone_volume(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        with open(str(tmpdir + "/d/foo.txt"), "w+") as f:
+            f.write("foo")
+        assert e.umount(tmpdir + "/d")
+        assert e.clone_volume(tmpdir + "/e", tmpdir + "/c")
+        assert e.mount(tmpdir + "/c", tmpdir + "/d", "PASSWORD")
+        with open(str(tmpdir + "/d/foo.txt")) as f:
+            assert f.read() == "foo"
+        assert e.umount(tmpdir + "/d")
+
+    def test_clone_volume_new_password(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert e.umount(tmpdir + "/d")
+        assert e.clone_volume(tmpdir + "/e", tmpdir + "/c", "PASSWD",
+                              "PASSWORD")
+        assert e.check_password(tmpdir + "/c", "PASSWD")
+        assert e.check_password(tmpdir + "/e", "PASSWORD")
+
+    def test_clone_new_password_without_password(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert not e.clone_volume(tmpdir + "/e", tmpdir + "/c", "PASSWD")
+        assert "Current password required" in caplog.text
+
+    def test_clone_removed_on_password_failure(self, tmpdir, caplog):
+        e = PyEncfs()
+        write_config(tmpdir + "/e")
+        with mock.patch.object(e, "change_password", return_value=False):
+            assert not e.clone_volume(tmpdir + "/e", tmpdir + "/c",
+                                      "PASSWD", "PASSWORD")
+        assert not os.path.exists(str(tmpdir + "/c"))
+        assert "Failed to change password of clone" in caplog.text
+
+    def test_clone_no_encfs(self, tmpdir, caplog):
+        e = PyEncfs()
+        assert not e.clone_volume(tmpdir, tmpdir + "/c")
+        assert "No encfs configuration found" in caplog.text
+
+
+class TestPyEncfsLock(LoggingCount):
+
+    def test_lock_serializes(self, tmpdir):
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        entered = threading.Event()
+
+        def other():
+            with e._lock(tmpdir + "/d"):
+                entered.set()
+
+        with e._lock(tmpdir + "/d", tmpdir + "/e"):
+            t = threading.Thread(target=other)
+            t.start()
+            assert not entered.wait(0.2)
+        t.join(5)
+        assert entered.is_set()
+        assert len(os.listdir(str(tmpdir + "/locks"))) == 2
+
+    def test_lock_reentrant(self, tmpdir):
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        with e._lock(tmpdir + "/d"):
+            with e._lock(tmpdir + "/d", tmpdir + "/e"):
+                assert len(e._held.keys) == 2
+            assert len(e._held.keys) == 1
+        assert e._held.keys == set()
+
+    def test_create_holds_lock(self, tmpdir):
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        with mock.patch("fcntl.flock") as flock:
+            e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert flock.call_count == 2
+
+    def test_default_lockdir(self, tmpdir):
+        with mock.patch.dict("os.environ", {"XDG_RUNTIME_DIR": str(tmpdir)}):
+            e = PyEncfs()
+        assert e.lockdir == str(tmpdir + "/pyencfs-locks")
+        with e._lock(tmpdir + "/d"):
+            pass
+        assert os.stat(e.lockdir).st_mode & 0o777 == 0o700
+
+    def test_lockdir_is_symlink(self, tmpdir, caplog):
+        os.makedirs(str(tmpdir + "/real"))
+        os.symlink(str(tmpdir + "/real"), str(tmpdir + "/locks"))
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        assert not e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert "Unsafe lock directory" in caplog.text
+        assert os.listdir(str(tmpdir + "/real")) == []
+
+    def test_lockdir_is_file(self, tmpdir, caplog):
+        open(str(tmpdir + "/locks"), "w+")
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        assert not e.mount(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert "Failed to lock" in caplog.text
+
+    def test_backup_reverse_holds_lock(self, tmpdir):
+        e = PyEncfs(lockdir=tmpdir + "/locks")
+        os.makedirs(str(tmpdir + "/p"))
+        with mock.patch("fcntl.flock") as flock, \
+                mock.patch("subprocess.run"):
+            assert not e.backup_reverse(tmpdir + "/p", tmpdir + "/v",
+                                        tmpdir + "/t", "PASSWORD")
+        assert flock.call_count == 3
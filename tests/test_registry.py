@@ -0,0 +1,83 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.registry import VolumeRegistry, MOUNTED, UNMOUNTED
+from src.pyencfs.pyencfs import PyEncfs
+import collections
+import os
+import mock
+
+
+Partition = collections.namedtuple("Partition",
+                                   ["device", "mountpoint", "fstype"])
+
+
+class TestVolumeRegistry(LoggingCount):
+
+    def test_record_and_get(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        r.record(tmpdir + "/e", tmpdir + "/d", "--standard", MOUNTED)
+        r.record(tmpdir + "/e", state=UNMOUNTED)
+        v = r.get(tmpdir + "/e")
+        assert v["path_decrypted"] == str(tmpdir + "/d")
+        assert v["profile"] == "--standard"
+        assert v["state"] == UNMOUNTED
+        assert r.get(tmpdir + "/x") is None
+        r.close()
+
+    def test_persistent(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        r.record(tmpdir + "/e", tmpdir + "/d", "--standard", MOUNTED)
+        r.close()
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        assert len(r.volumes()) == 1
+        r.remove(tmpdir + "/e")
+        assert r.volumes() == []
+
+    def test_unmounted(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        r.record(tmpdir + "/e", tmpdir + "/d", "--standard", MOUNTED)
+        r.unmounted(tmpdir + "/d")
+        assert r.get(tmpdir + "/e")["state"] == UNMOUNTED
+
+    def test_reconcile(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        r.record(tmpdir + "/e1", tmpdir + "/d1", "--standard", UNMOUNTED)
+        r.record(tmpdir + "/e2", tmpdir + "/d2", "--standard", MOUNTED)
+        parts = [Partition("encfs", str(tmpdir + "/d1"), "fuse.encfs"),
+                 Partition("/dev/sda1", str(tmpdir + "/d2"), "ext4")]
+        with mock.patch("psutil.disk_partitions",
+                        mock.MagicMock(return_value=parts)):
+            volumes = r.reconcile()
+        assert [v["state"] for v in volumes] == [MOUNTED, UNMOUNTED]
+
+
+class TestPyEncfsRegistry(LoggingCount):
+
+    def test_registry_updates(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        e = PyEncfs(registry=r)
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert r.get(tmpdir + "/e")["state"] == MOUNTED
+        assert e.umount(tmpdir + "/d")
+        assert r.get(tmpdir + "/e")["state"] == UNMOUNTED
+        assert r.reconcile()[0]["state"] == UNMOUNTED
+
+    def test_registry_skips_internal_mounts(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        e = PyEncfs(registry=r)
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        assert e.umount(tmpdir + "/d")
+        assert e.rekey_volume(tmpdir + "/e", "PASSWORD",
+                              tmpdir + "/n", "PASSWD", profile="--paranoia")
+        assert [(v["path_encrypted"], v["path_decrypted"], v["profile"],
+                 v["state"]) for v in r.volumes()] == [
+                (str(tmpdir + "/e"), str(tmpdir + "/d"), "--paranoia",
+                 UNMOUNTED),
+                (str(tmpdir + "/n"), None, "--standard", UNMOUNTED)]
+
+    def test_registry_skips_backup_view(self, tmpdir):
+        r = VolumeRegistry(tmpdir + "/registry.db")
+        e = PyEncfs(registry=r)
+        os.makedirs(str(tmpdir + "/p"))
+        assert e.backup_reverse(tmpdir + "/p", tmpdir + "/v", tmpdir + "/t",
+                                "PASSWORD")
+        assert r.volumes() == []
@@ -0,0 +1,152 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.config import read_config, header_size, block_overhead
+from src.pyencfs.scrub import Scrubber
+from src.pyencfs.pyencfs import PyEncfs
+from tests.utils.config import write_config
+import json
+import logging
+import os
+import mock
+
+
+class TestConfig(LoggingCount):
+
+    def test_read_config(self, tmpdir):
+        write_config(tmpdir)
+        config = read_config(tmpdir)
+        assert config["block_size"] == 1024
+        assert config["block_mac_bytes"] == 8
+        assert config["unique_iv"] is True
+        assert config["cipher"] == "ssl/aes"
+        assert config["name_encoding"] == "nameio/block"
+        assert "encodedKeyData" not in config
+        assert header_size(config) == 8
+        assert block_overhead(config) == 8
+
+    def test_read_missing_config(self, tmpdir):
+        assert read_config(tmpdir) is None
+
+    def test_read_invalid_config(self, tmpdir):
+        with open(str(tmpdir + "/.encfs6.xml"), "w+") as f:
+            f.write("<cfg>")
+        assert read_config(tmpdir) is None
+
+
+class TestScrubber(LoggingCount):
+
+    def test_scrub_clean(self, tmpdir):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/d/a"))
+        with open(str(tmpdir + "/d/a/foo"), "wb") as f:
+            f.write(b"x" * 5000)
+        assert Scrubber(tmpdir + "/e", tmpdir + "/d", 2).run() == []
+
+    def test_scrub_reports_corrupted_blocks(self, tmpdir, caplog):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/d"))
+        with open(str(tmpdir + "/d/foo"), "wb") as f:
+            f.write(b"x" * 5000)
+        pread = os.pread
+
+        def failing_pread(fd, count, offset):
+            if offset == 2 * 1016:
+                raise OSError(5, "Input/output error")
+            return pread(fd, count, offset)
+
+        with mock.patch("os.pread", side_effect=failing_pread):
+            errors = Scrubber(tmpdir + "/e", tmpdir + "/d", 2).run()
+        assert errors == [{"path": "foo", "offset": 2032,
+                           "encrypted_offset": 8 + 2048,
+                           "error": "Input/output error"}]
+        assert "Corrupted block in foo" in caplog.text
+
+    def test_scrub_rechecks_page_with_direct_io(self, tmpdir, caplog):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/d"))
+        with open(str(tmpdir + "/d/foo"), "wb") as f:
+            f.write(b"x" * 5000)
+        open_ = os.open
+        pread = os.pread
+        direct = set()
+
+        def recording_open(path, flags):
+            fd = open_(path, flags & ~os.O_DIRECT)
+            if flags & os.O_DIRECT:
+                direct.add(fd)
+            return fd
+
+        def failing_pread(fd, count, offset):
+            # a cached read fails for the whole page of the corrupted block
+            if offset < 4096 and (fd not in direct or offset == 2032):
+                raise OSError(5, "Input/output error")
+            return pread(fd, count, offset)
+
+        with mock.patch("os.open", side_effect=recording_open), \
+                mock.patch("os.pread", side_effect=failing_pread):
+            errors = Scrubber(tmpdir + "/e", tmpdir + "/d", 2).run()
+        assert [e["offset"] for e in errors] == [2032]
+        assert len(direct) == 1
+
+    def test_scrub_checkpoint(self, tmpdir):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/d"))
+        for name in ["foo", "bar"]:
+            with open(os.path.join(str(tmpdir), "d", name), "wb") as f:
+                f.write(b"x" * 100)
+        with open(str(tmpdir + "/checkpoint"), "w+") as f:
+            f.write(json.dumps({"done": "foo"}) + "\n")
+        opened = []
+        open_ = os.open
+
+        def recording_open(path, flags):
+            opened.append(os.path.basename(path))
+            return open_(path, flags)
+
+        with mock.patch("os.open", side_effect=recording_open):
+            assert Scrubber(tmpdir + "/e", tmpdir + "/d", 2,
+                            checkpoint=tmpdir + "/checkpoint").run() == []
+        assert opened == ["bar"]
+        assert not os.path.exists(str(tmpdir + "/checkpoint"))
+
+    def test_scrub_reports_unreadable_files(self, tmpdir, caplog):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/d"))
+        for name in ["foo", "bar"]:
+            with open(os.path.join(str(tmpdir), "d", name), "wb") as f:
+                f.write(b"x" * 100)
+        open_ = os.open
+
+        def failing_open(path, flags):
+            if os.path.basename(path) == "foo":
+                raise PermissionError(13, "Permission denied", path)
+            return open_(path, flags)
+
+        with mock.patch("os.open", side_effect=failing_open):
+            errors = Scrubber(tmpdir + "/e", tmpdir + "/d", 2).run()
+        assert errors == [{"path": "foo", "offset": None,
+                           "encrypted_offset": None,
+                           "error": "Permission denied"}]
+        assert "Failed to read foo" in caplog.text
+
+    def test_scrub_without_config(self, tmpdir, caplog):
+        assert Scrubber(tmpdir, tmpdir).run() is None
+        assert "Failed to read encfs configuration" in caplog.text
+
+
+class TestPyEncfsScrub(LoggingCount):
+
+    def test_scrub_mounts_volume(self, tmpdir, caplog):
+        caplog.set_level(logging.DEBUG)
+        e = PyEncfs("--paranoia")
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        with open(str(tmpdir + "/d/foo"), "wb") as f:
+            f.write(b"x" * 5000)
+        assert e.umount(tmpdir + "/d")
+        assert e.scrub(tmpdir + "/e", tmpdir + "/d", "PASSWORD") == []
+        assert not os.path.ismount(str(tmpdir + "/d"))
+        assert "Scrub found no corrupted blocks" in caplog.text
+
+    def test_scrub_not_mounted_without_password(self, tmpdir, caplog):
+        e = PyEncfs("--paranoia")
+        assert e.scrub(tmpdir + "/e", tmpdir + "/d") is None
+        assert "Volume is not mounted and no password" in caplog.text
@@ -0,0 +1,87 @@
+from tests.utils.logging import LoggingCount
+from src.pyencfs.store import ShardedStore
+import os
+import mock
+import pytest
+
+
+def shards(tmpdir, count):
+    result = []
+    for i in range(count):
+        d = str(tmpdir + "/d%d" % i)
+        os.makedirs(d)
+        result.append((str(tmpdir + "/e%d" % i), d))
+    return result
+
+
+@pytest.fixture
+def mounted():
+    with mock.patch("src.pyencfs.pyencfs.PyEncfs._isencfsmount",
+                    return_value=True):
+        yield
+
+
+class TestShardedStore(LoggingCount):
+
+    def test_open_list_stat(self, tmpdir, mounted):
+        s = ShardedStore(shards(tmpdir, 3), "PASSWORD")
+        for i in range(30):
+            with s.open("dir/file%d" % i, "w") as f:
+                f.write("x" * i)
+        assert s.list() == sorted("dir/file%d" % i for i in range(30))
+        assert s.stat("dir/file7").st_size == 7
+        assert s.exists("/dir/file7")
+        s.remove("dir/file7")
+        assert not s.exists("dir/file7")
+        used = [d for e, d in s.shards if os.listdir(d)]
+        assert len(used) == 3
+
+    def test_stable_assignment(self, tmpdir):
+        a = ShardedStore(shards(tmpdir, 3), "PASSWORD")
+        b = ShardedStore(list(reversed(a.shards)), "PASSWORD")
+        for i in range(30):
+            assert a.shard("file%d" % i) == b.shard("file%d" % i)
+
+    def test_invalid_path(self, tmpdir):
+        s = ShardedStore(shards(tmpdir, 1), "PASSWORD")
+        with pytest.raises(ValueError):
+            s.open("../foo", "w")
+
+    def test_list_without_shards(self):
+        assert ShardedStore([], "PASSWORD").list() == []
+
+    @pytest.mark.parametrize("workers", [1, None])
+    def test_rebalance(self, tmpdir, workers, mounted):
+        all_shards = shards(tmpdir, 3)
+        s = ShardedStore(all_shards[:2], "PASSWORD", workers=workers)
+        for i in range(60):
+            with s.open("file%d" % i, "w") as f:
+                f.write(str(i))
+        s.shards.append(all_shards[2])
+        moved = s.rebalance()
+        assert 0 < moved < 60
+        assert len(os.listdir(all_shards[2][1])) == moved
+        for i in range(60):
+            with s.open("file%d" % i) as f:
+                assert f.read() == str(i)
+        assert s.rebalance() == 0
+
+    def test_unmounted_shard(self, tmpdir):
+        s = ShardedStore(shards(tmpdir, 2), "PASSWORD")
+        with pytest.raises(OSError):
+            s.open("foo", "w")
+        with pytest.raises(OSError):
+            s.rebalance()
+        assert not any(os.listdir(d) for e, d in s.shards)
+
+    def test_create_and_add_shard(self, tmpdir):
+        s = ShardedStore([(tmpdir + "/e0", tmpdir + "/d0")], "PASSWORD")
+        assert s.create()
+        with s.open("foo", "w") as f:
+            f.write("foo")
+        assert s.add_shard(tmpdir + "/e1", tmpdir + "/d1")
+        s.rebalance()
+        assert s.list() == ["foo"]
+        assert s.umount()
+        assert s.mount()
+        assert s.umount()
@@ -0,0 +1,65 @@
+from tests.utils.logging import LoggingCount
+from tests.utils.config import write_config
+from src.pyencfs.stream import export_stream, import_stream
+from src.pyencfs.copytree import compare_trees
+from src.pyencfs.pyencfs import PyEncfs
+import io
+import os
+import pytest
+
+
+def fill(path):
+    write_config(path)
+    os.makedirs(str(path + "/a/b"))
+    with open(str(path + "/foo"), "wb") as f:
+        f.write(os.urandom(3 << 20))
+    with open(str(path + "/a/b/bar"), "wb") as f:
+        f.write(b"bar")
+    os.symlink("foo", str(path + "/a/link"))
+
+
+class TestStream(LoggingCount):
+
+    @pytest.mark.parametrize("compression", [None, "gz", "bz2", "xz"])
+    def test_roundtrip_encrypted(self, tmpdir, compression):
+        fill(tmpdir + "/e")
+        buf = io.BytesIO()
+        assert export_stream(tmpdir + "/e", buf, compression=compression)
+        buf.seek(0)
+        assert import_stream(buf, tmpdir + "/i", compression=compression)
+        assert compare_trees(tmpdir + "/e", tmpdir + "/i") == []
+        assert os.readlink(str(tmpdir + "/i/a/link")) == "foo"
+
+    def test_export_no_volume(self, tmpdir, caplog):
+        assert not export_stream(tmpdir, io.BytesIO())
+        assert "No encfs configuration found" in caplog.text
+
+    def test_export_decrypted_not_mounted(self, tmpdir, caplog):
+        assert not export_stream(tmpdir, io.BytesIO(), encrypted=False)
+        assert "Given path is no mount point" in caplog.text
+
+    def test_import_not_empty(self, tmpdir, caplog):
+        fill(tmpdir + "/e")
+        assert not import_stream(io.BytesIO(), tmpdir + "/e")
+        assert "Given path is not empty" in caplog.text
+
+    def test_import_invalid_stream(self, tmpdir, caplog):
+        assert not import_stream(io.BytesIO(b"invalid" * 1000),
+                                 tmpdir + "/i", compression="gz")
+        assert "Failed to import" in caplog.text
+
+    def test_roundtrip_decrypted(self, tmpdir):
+        e = PyEncfs()
+        assert e.create(tmpdir + "/e", tmpdir + "/d", "PASSWORD")
+        with open(str(tmpdir + "/d/foo"), "w+") as f:
+            f.write("foo")
+        buf = io.BytesIO()
+        assert export_stream(tmpdir + "/d", buf, encrypted=False,
+                             compression="gz")
+        assert e.create(tmpdir + "/e2", tmpdir + "/d2", "PASSWORD")
+        buf.seek(0)
+        assert import_stream(buf, tmpdir + "/d2", encrypted=False,
+                             compression="gz")
+        assert compare_trees(tmpdir + "/d", tmpdir + "/d2") == []
+        assert e.umount(tmpdir + "/d")
+        assert e.umount(tmpdir + "/d2")
@@ -0,0 +1,57 @@
+from tests.utils.logging import LoggingCount
+from tests.utils.config import write_config
+from src.pyencfs.config import read_config, plain_size
+from src.pyencfs.usage import usage
+import os
+
+
+def write(path, size):
+    with open(str(path), "wb") as f:
+        f.write(b"x" * size)
+
+
+class TestPlainSize(LoggingCount):
+
+    def test_plain_size(self, tmpdir):
+        write_config(tmpdir)
+        config = read_config(tmpdir)
+        assert plain_size(config, 0) == 0
+        assert plain_size(config, 8) == 0
+        assert plain_size(config, 8 + 1024) == 1016
+        assert plain_size(config, 8 + 2048 + 100) == 2 * 1016 + 92
+
+    def test_plain_size_standard(self):
+        config = {"block_size": 1024, "unique_iv": True,
+                  "block_mac_bytes": 0, "block_mac_rand_bytes": 0}
+        assert plain_size(config, 8 + 5000) == 5000
+
+
+class TestUsage(LoggingCount):
+
+    def test_usage(self, tmpdir):
+        write_config(tmpdir + "/e")
+        os.makedirs(str(tmpdir + "/e/abc"))
+        write(tmpdir + "/e/abcd", 8 + 2048 + 100)
+        write(tmpdir + "/e/abc/ef", 8 + 1024)
+        u = usage(tmpdir + "/e", 2)
+        assert u["files"] == 2
+        assert u["dirs"] == 1
+        assert u["encrypted_bytes"] == 8 + 2048 + 100 + 8 + 1024
+        assert u["plain_bytes"] == 2 * 1016 + 92 + 1016
+        assert u["header_bytes"] == 16
+        assert u["mac_bytes"] == 4 * 8
+        assert u["overhead_bytes"] == 16 + 32
+        assert u["name_bytes"] == 6
+
+    def test_usage_cache(self, tmpdir):
+        write_config(tmpdir + "/e")
+        write(tmpdir + "/e/abcd", 8 + 1024)
+        cache = tmpdir + "/usage.json"
+        assert usage(tmpdir + "/e", cache=cache)["plain_bytes"] == 1016
+        assert os.path.isfile(str(cache))
+        write(tmpdir + "/e/efgh", 8 + 1024)
+        assert usage(tmpdir + "/e", cache=cache)["plain_bytes"] == 2032
+
+    def test_usage_without_config(self, tmpdir, caplog):
+        assert usage(tmpdir) is None
+        assert "Failed to read encfs configuration" in caplog.text
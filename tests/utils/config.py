@@ -0,0 +1,43 @@
+import os
+
+
+CONFIG = """<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>
+<!DOCTYPE boost_serialization>
+<boost_serialization signature="serialization::archive" version="7">
+    <cfg class_id="0" tracking_level="0" version="20">
+        <version>20100713</version>
+        <creator>EncFS 1.9.5</creator>
+        <cipherAlg class_id="1" tracking_level="0" version="0">
+            <name>ssl/aes</name>
+            <major>3</major>
+            <minor>0</minor>
+        </cipherAlg>
+        <nameAlg>
+            <name>nameio/block</name>
+            <major>4</major>
+            <minor>0</minor>
+        </nameAlg>
+        <keySize>256</keySize>
+        <blockSize>1024</blockSize>
+        <plainData>0</plainData>
+        <uniqueIV>1</uniqueIV>
+        <chainedNameIV>1</chainedNameIV>
+        <externalIVChaining>1</externalIVChaining>
+        <blockMACBytes>8</blockMACBytes>
+        <blockMACRandBytes>0</blockMACRandBytes>
+        <allowHoles>1</allowHoles>
+        <encodedKeySize>52</encodedKeySize>
+        <encodedKeyData>AAAA</encodedKeyData>
+        <saltLen>20</saltLen>
+        <saltData>AAAA</saltData>
+        <kdfIterations>170203</kdfIterations>
+        <desiredKDFDuration>3000</desiredKDFDuration>
+    </cfg>
+</boost_serialization>
+"""
+
+
+def write_config(path):
+    os.makedirs(str(path), exist_ok=True)
+    with open(str(path + "/.encfs6.xml"), "w+") as f:
+        f.write(CONFIG)